@@ -1,63 +1,50 @@
 import sys
-import os
-import subprocess
 from PyQt5.QtWidgets import (
     QApplication, QWidget, QPushButton, QFileDialog, QLabel, QVBoxLayout, QProgressBar,
-    QMessageBox, QLineEdit
+    QMessageBox, QPlainTextEdit, QTableWidget, QTableWidgetItem, QHeaderView
 )
-from PyQt5.QtCore import Qt, QThread, pyqtSignal
+from PyQt5.QtCore import Qt, QObject, pyqtSignal
 
-# -------------------- QThread 任務處理 --------------------
-class KTVWorker(QThread):
-    progress_signal = pyqtSignal(int)
-    finished_signal = pyqtSignal(bool, str)
+from ktv_pipeline import KTVPipeline
 
-    def __init__(self, youtube_url, output_dir="output", bg_image="black.jpg"):
+# 各階段在整體進度中所佔的區間
+STAGE_RANGES = {
+    "download": (0, 20),
+    "separate": (20, 60),
+    "transcribe": (60, 90),
+    "render": (90, 100),
+}
+
+STAGE_NAMES = {
+    "download": "⏬ 下載 YouTube 音樂中...",
+    "separate": "🎧 分離人聲與伴奏中...",
+    "transcribe": "📝 生成字幕中...",
+    "render": "🎬 合成影片中...",
+}
+
+
+# -------------------- 工作佇列 --------------------
+# 在背景執行 KTVPipeline，把流水線執行緒送出的進度事件轉成 Qt signal，
+# 讓主執行緒更新畫面。
+class KTVJobQueue(QObject):
+    event_signal = pyqtSignal(object)
+
+    def __init__(self, output_dir="output", bg_image="black.jpg", gpu=-1):
         super().__init__()
-        self.youtube_url = youtube_url
         self.output_dir = output_dir
         self.bg_image = bg_image
-
-    def run(self):
-        try:
-            self.progress_signal.emit(10)
-            if not os.path.exists(self.output_dir):
-                os.makedirs(self.output_dir)
-
-            env = os.environ.copy()
-            env["KTV_BG_IMAGE"] = self.bg_image
-
-            process = subprocess.Popen(
-                #["python", "ktv_tool.py", "--input", self.youtube_url, "--gpu", "0"] #gpu mode
-                ["python", "ktv_tool.py", "--input", self.youtube_url],
-                stdout=subprocess.PIPE,
-                stderr=subprocess.STDOUT,
-                text=True,
-                bufsize=1,
-                env=env
+        self.gpu = gpu  # 0 為 GPU 模式
+        self.pipeline = None
+
+    def submit(self, youtube_url, output_dir, bg_image):
+        if self.pipeline is None:
+            self.pipeline = KTVPipeline(
+                output_dir=self.output_dir, bg_image=self.bg_image, gpu=self.gpu,
+                on_event=self.event_signal.emit
             )
+            self.pipeline.start()
 
-            for line in iter(process.stdout.readline, ''):
-                print("[LOG]", line.strip())
-                if "下載音樂中" in line:
-                    self.progress_signal.emit(20)
-                elif "分離人聲與伴奏" in line:
-                    self.progress_signal.emit(40)
-                elif "生成字幕檔" in line:
-                    self.progress_signal.emit(70)
-                elif "合成 KTV 影片" in line:
-                    self.progress_signal.emit(90)
-
-            process.stdout.close()
-            process.wait()
-
-            if process.returncode == 0:
-                self.progress_signal.emit(100)
-                self.finished_signal.emit(True, "output/影片檔案名稱.mp4")
-            else:
-                self.finished_signal.emit(False, "")
-        except Exception as e:
-            self.finished_signal.emit(False, str(e))
+        return self.pipeline.submit(youtube_url, output_dir=output_dir, bg_image=bg_image)
 
 
 # -------------------- 主視窗介面 --------------------
@@ -68,13 +55,14 @@ class KTVApp(QWidget):
 
     def initUI(self):
         self.setWindowTitle("KTV 製作工具（YouTube 版）")
-        self.setGeometry(100, 100, 500, 360)
+        self.setGeometry(100, 100, 640, 520)
 
-        self.label = QLabel("請輸入 YouTube 音樂網址：")
+        self.label = QLabel("請輸入 YouTube 音樂網址（一行一個）：")
         self.label.setAlignment(Qt.AlignCenter)
 
-        self.inputURL = QLineEdit()
+        self.inputURL = QPlainTextEdit()
         self.inputURL.setPlaceholderText("https://www.youtube.com/watch?v=xxxx")
+        self.inputURL.setMaximumHeight(90)
 
         self.btnOutput = QPushButton("選擇輸出資料夾")
         self.btnOutput.clicked.connect(self.selectOutputDir)
@@ -88,11 +76,13 @@ class KTVApp(QWidget):
         self.labelBG = QLabel("背景圖片：black.jpg")
         self.labelBG.setAlignment(Qt.AlignLeft)
 
-        self.btnProcess = QPushButton("開始製作 KTV 影片")
+        self.btnProcess = QPushButton("加入佇列並開始製作")
         self.btnProcess.clicked.connect(self.processAudio)
 
-        self.progressBar = QProgressBar(self)
-        self.progressBar.setValue(0)
+        self.jobTable = QTableWidget(0, 3)
+        self.jobTable.setHorizontalHeaderLabels(["網址 / 歌曲", "狀態", "進度"])
+        self.jobTable.horizontalHeader().setSectionResizeMode(0, QHeaderView.Stretch)
+        self.jobTable.verticalHeader().setVisible(False)
 
         self.statusLabel = QLabel("目前狀態：等待中")
         self.statusLabel.setAlignment(Qt.AlignLeft)
@@ -105,14 +95,18 @@ class KTVApp(QWidget):
         layout.addWidget(self.btnBG)
         layout.addWidget(self.labelBG)
         layout.addWidget(self.btnProcess)
-        layout.addWidget(self.progressBar)
+        layout.addWidget(self.jobTable)
         layout.addWidget(self.statusLabel)
         self.setLayout(layout)
 
-        self.youtube_url = ""
         self.output_dir = "output"
         self.bg_image = "black.jpg"
-        self.worker = None
+        self.rows = {}  # job id -> 表格列
+        self.finished_jobs = 0
+        self.failed_jobs = 0
+
+        self.jobQueue = KTVJobQueue(self.output_dir, self.bg_image)
+        self.jobQueue.event_signal.connect(self.onEvent)
 
     def selectOutputDir(self):
         dir_path = QFileDialog.getExistingDirectory(self, "選擇輸出資料夾")
@@ -128,40 +122,63 @@ class KTVApp(QWidget):
             self.labelBG.setText(f"背景圖片：{file_path}")
 
     def processAudio(self):
-        self.youtube_url = self.inputURL.text().strip()
-        if not self.youtube_url:
+        youtube_urls = [url.strip() for url in self.inputURL.toPlainText().splitlines() if url.strip()]
+        if not youtube_urls:
             QMessageBox.warning(self, "錯誤", "請先輸入 YouTube 網址！")
             return
 
-        self.btnProcess.setEnabled(False)
-
-        self.worker = KTVWorker(self.youtube_url, self.output_dir, self.bg_image)
-        self.worker.progress_signal.connect(self.updateProgress)
-        self.worker.finished_signal.connect(self.processFinished)
-        self.worker.start()
-
-    def updateProgress(self, value):
-        self.progressBar.setValue(value)
-        if value == 20:
-            self.statusLabel.setText("目前狀態：⏬ 下載 YouTube 音樂中...")
-        elif value == 40:
-            self.statusLabel.setText("目前狀態：🎧 分離人聲與伴奏中...")
-        elif value == 70:
-            self.statusLabel.setText("目前狀態：📝 生成字幕中...")
-        elif value == 90:
-            self.statusLabel.setText("目前狀態：🎬 合成影片中...")
-        elif value == 100:
-            self.statusLabel.setText("目前狀態：✅ 製作完成！")
-
-    def processFinished(self, success, output_video):
-        if success:
-            QMessageBox.information(self, "成功", f"KTV 影片已產出：\n{output_video}")
+        # 製作中也可以繼續加入新的網址
+        for youtube_url in youtube_urls:
+            self.jobQueue.submit(youtube_url, self.output_dir, self.bg_image)
+        self.inputURL.clear()
+
+    def addRow(self, job):
+        row = self.jobTable.rowCount()
+        self.jobTable.insertRow(row)
+        self.jobTable.setItem(row, 0, QTableWidgetItem(job.url))
+        self.jobTable.setItem(row, 1, QTableWidgetItem("排隊中"))
+        progressBar = QProgressBar()
+        progressBar.setValue(0)
+        self.jobTable.setCellWidget(row, 2, progressBar)
+        self.rows[job.id] = row
+
+    def onEvent(self, event):
+        job = event.job
+        if job.id not in self.rows:
+            self.addRow(job)
+        row = self.rows[job.id]
+        statusItem = self.jobTable.item(row, 1)
+        progressBar = self.jobTable.cellWidget(row, 2)
+
+        if job.basename:
+            self.jobTable.item(row, 0).setText(job.basename)
+
+        if event.status == "finished":
+            progressBar.setValue(100)
+            statusItem.setText("✅ 製作完成！")
+            statusItem.setToolTip(event.message)
+            self.finished_jobs += 1
+        elif event.status == "error":
+            statusItem.setText("❌ 製作失敗")
+            statusItem.setToolTip(event.message)
+            if event.stage is None:
+                self.failed_jobs += 1
+        elif event.stage is not None:
+            low, high = STAGE_RANGES[event.stage]
+            progressBar.setValue(int(low + (high - low) * event.percent / 100))
+            statusItem.setText(f"{STAGE_NAMES[event.stage]} {event.percent}%")
+
+        self.updateStatus()
+
+    def updateStatus(self):
+        total = len(self.rows)
+        running = total - self.finished_jobs - self.failed_jobs
+        if running == 0:
+            self.statusLabel.setText(f"目前狀態：等待中（完成 {self.finished_jobs}，失敗 {self.failed_jobs}）")
         else:
-            QMessageBox.critical(self, "錯誤", "KTV 製作失敗！")
-
-        self.btnProcess.setEnabled(True)
-        self.progressBar.setValue(0)
-        self.statusLabel.setText("目前狀態：等待中")
+            self.statusLabel.setText(
+                f"目前狀態：處理中 {running} 首（完成 {self.finished_jobs}，失敗 {self.failed_jobs}）"
+            )
 
 
 # -------------------- 主函數 --------------------
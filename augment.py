@@ -19,8 +19,11 @@ if __name__ == '__main__':
     p.add_argument('--pitch', '-p', type=int, default=-1)
     p.add_argument('--mixtures', '-m', required=True)
     p.add_argument('--instruments', '-i', required=True)
+    p.add_argument('--stft_backend', type=str, choices=list(spec_utils.BACKENDS), default='librosa')
     args = p.parse_args()
 
+    spec_utils.set_backend(args.stft_backend)
+
     input_i = 'input_i_{}.wav'.format(args.pitch)
     input_v = 'input_v_{}.wav'.format(args.pitch)
     output_i = 'output_i_{}.wav'.format(args.pitch)
@@ -0,0 +1,47 @@
+import argparse
+
+import inference
+from lib import autotune
+from lib import replicas
+from lib import result_cache
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument('--gpu', '-g', type=int, default=-1)
+    p.add_argument('--pretrained_model', '-P', type=str, default=inference.DEFAULT_MODEL_PATH)
+    p.add_argument('--n_fft', '-f', type=int, default=None, help='default: from the checkpoint')
+    p.add_argument('--hop_length', '-H', type=int, default=None, help='default: from the checkpoint')
+    p.add_argument('--complex', '-X', action='store_true', default=None)
+    p.add_argument('--cropsizes', type=int, nargs='+', default=autotune.CROPSIZES)
+    p.add_argument('--batchsizes', type=int, nargs='+', default=autotune.BATCHSIZES)
+    p.add_argument('--n_batches', type=int, default=4, help='timed batches per combination')
+    p.add_argument('--max_memory', type=int, default=None, help='skip combinations above this peak memory in MB')
+    p.add_argument('--threads', type=int, default=None, help='intra-op threads, the profile is stored per thread count')
+    p.add_argument('--profile', type=str, default=autotune.DEFAULT_PROFILE_PATH)
+    args = p.parse_args()
+
+    if args.threads is not None:
+        replicas.set_threads(args.threads)
+
+    print('loading model...', end=' ')
+    device = inference.get_device(args.gpu)
+    model = inference.load_model(args.pretrained_model, args.n_fft, args.hop_length, args.complex, device)
+    print('done')
+
+    max_memory = args.max_memory * 1024 ** 2 if args.max_memory is not None else None
+    results = autotune.benchmark(model, device, args.cropsizes, args.batchsizes, args.n_batches, max_memory)
+    if len(results) == 0:
+        print('no combination could be run')
+        return
+
+    best = max(results, key=lambda r: r['frames_per_sec'])
+    key = autotune.profile_key(device, result_cache.checkpoint_hash(args.pretrained_model), model.n_fft)
+    autotune.save_profile(key, dict(best, results=results), args.profile)
+    print('best: --cropsize {} --batchsize {} ({:.1f} frames/sec), saved to {}'.format(
+        best['cropsize'], best['batchsize'], best['frames_per_sec'], args.profile
+    ))
+
+
+if __name__ == '__main__':
+    main()
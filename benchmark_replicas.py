@@ -0,0 +1,44 @@
+import argparse
+
+import inference
+from lib import quantize
+from lib import replicas
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument('--pretrained_model', '-P', type=str, default=inference.DEFAULT_MODEL_PATH)
+    p.add_argument('--n_fft', '-f', type=int, default=None, help='default: from the checkpoint')
+    p.add_argument('--hop_length', '-H', type=int, default=None, help='default: from the checkpoint')
+    p.add_argument('--complex', '-X', action='store_true', default=None)
+    p.add_argument('--batchsize', '-B', type=int, default=4)
+    p.add_argument('--cropsize', '-c', type=int, default=256)
+    p.add_argument('--cores', type=str, default=None, help='cores to split, e.g. 0-31 (default: all available)')
+    p.add_argument('--n_batches', type=int, default=8, help='timed batches per split')
+    p.add_argument('--precision', type=str, choices=quantize.PRECISIONS, default='fp32')
+    args = p.parse_args()
+
+    print('loading model...', end=' ')
+    model = inference.load_model(args.pretrained_model, args.n_fft, args.hop_length, args.complex)
+    model = inference.apply_precision(model, args.precision)
+    print('done')
+
+    cores = replicas.parse_cores(args.cores) if args.cores is not None else replicas.available_cores()
+    print('benchmarking {} cores...'.format(len(cores)))
+    results = replicas.benchmark(
+        model, cores, args.batchsize, args.cropsize, args.n_batches, args.precision
+    )
+
+    print('replicas  threads  patches/sec')
+    for n_replicas, threads, throughput in results:
+        print('{:>8}  {:>7}  {:>11.2f}'.format(n_replicas, threads, throughput))
+
+    n_replicas, threads, _ = max(results, key=lambda r: r[2])
+    if n_replicas > 1:
+        print('best: --replicas {} --threads {}'.format(n_replicas, threads))
+    else:
+        print('best: --threads {}'.format(threads))
+
+
+if __name__ == '__main__':
+    main()
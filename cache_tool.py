@@ -0,0 +1,62 @@
+import argparse
+import time
+
+from lib import result_cache
+
+
+def format_size(nbytes):
+    for unit in ['B', 'KB', 'MB', 'GB']:
+        if nbytes < 1024 or unit == 'GB':
+            return '{:.1f}{}'.format(nbytes, unit)
+        nbytes /= 1024
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument('--cache_dir', '-d', type=str, default=result_cache.DEFAULT_CACHE_DIR)
+    sub = p.add_subparsers(dest='command', required=True)
+
+    sub.add_parser('list', help='show cached entries, most recently used first')
+    sub.add_parser('stats', help='show the total size of the cache')
+
+    p_evict = sub.add_parser('evict', help='drop least recently used entries down to a size')
+    p_evict.add_argument('--max_size', type=int, required=True, help='size limit in MB')
+
+    p_purge = sub.add_parser('purge', help='remove entries')
+    p_purge.add_argument('keys', nargs='*', help='entry keys or key prefixes, all entries if omitted')
+    p_purge.add_argument('--older_than', type=float, default=None, help='only entries unused for this many days')
+    args = p.parse_args()
+
+    cache = result_cache.ResultCache(args.cache_dir)
+
+    if args.command == 'list':
+        for key, entry in cache.entries():
+            print('{}  {:>9}  {:>4} hits  {}  {}  [{}]'.format(
+                key[:12],
+                format_size(entry['bytes']),
+                entry.get('hits', 0),
+                time.strftime('%Y-%m-%d %H:%M', time.localtime(entry['last_used'])),
+                entry.get('source'),
+                ', '.join(sorted(entry['files']))
+            ))
+    elif args.command == 'stats':
+        entries = cache.entries()
+        print('{} entries, {} in {}'.format(
+            len(entries), format_size(sum(entry['bytes'] for _, entry in entries)), args.cache_dir
+        ))
+    elif args.command == 'evict':
+        cache.evict(args.max_size * 1024 ** 2)
+        print('cache size is now {}'.format(format_size(cache.total_bytes())))
+    elif args.command == 'purge':
+        keys = None
+        if len(args.keys) > 0:
+            keys = [
+                key for key, _ in cache.entries()
+                if any(key.startswith(prefix) for prefix in args.keys)
+            ]
+        older_than = args.older_than * 86400 if args.older_than is not None else None
+        print('removed {} entries'.format(cache.purge(keys, older_than)))
+
+
+if __name__ == '__main__':
+    main()
@@ -2,13 +2,14 @@ import argparse
 import os
 # import re
 
-import librosa
 import numpy as np
 import soundfile as sf
 import torch
 
 from lib import dataset
+from lib import decode
 from lib import nets
+from lib import remote
 from lib import spec_utils
 
 import inference
@@ -30,16 +31,31 @@ def main():
     p.add_argument('--batchsize', '-B', type=int, default=4)
     p.add_argument('--cropsize', '-c', type=int, default=256)
     p.add_argument('--complex', '-X', action='store_true')
+    p.add_argument('--cache_format', type=str, choices=spec_utils.CACHE_FORMATS, default='complex64', help='mag16 is for non-complex training only')
+    p.add_argument('--cheap_tta', action='store_true', help='run the shifted tta pass only where the mask is uncertain')
+    p.add_argument('--decode_workers', type=int, default=2)
+    p.add_argument('--stft_backend', type=str, choices=list(spec_utils.BACKENDS), default='librosa')
+    p.add_argument('--server', '-s', type=str, default=None, help='separation_server.py address (host:port)')
     args = p.parse_args()
 
-    print('loading model...', end=' ')
-    device = torch.device('cpu')
-    model = nets.CascadedNet(args.n_fft, args.hop_length, is_complex=args.complex)
-    model.load_state_dict(torch.load(args.pretrained_model, map_location=device))
-    if torch.cuda.is_available() and args.gpu >= 0:
-        device = torch.device('cuda:{}'.format(args.gpu))
-        model.to(device)
-    print('done')
+    if args.server is not None:
+        sp = remote.SeparationClient(
+            args.server, args.pretrained_model, args.gpu, args.n_fft, args.hop_length,
+            args.batchsize, args.cropsize, args.complex, cheap_tta=args.cheap_tta
+        )
+    else:
+        print('loading model...', end=' ')
+        device = torch.device('cpu')
+        model = nets.load_checkpoint(args.pretrained_model, args.n_fft, args.hop_length, args.complex)
+        model.fuse_for_inference()
+        if torch.cuda.is_available() and args.gpu >= 0:
+            device = torch.device('cuda:{}'.format(args.gpu))
+            model.to(device)
+        print('done')
+
+        sp = inference.Separator(model, device, args.batchsize, args.cropsize, cheap_tta=args.cheap_tta)
+
+    spec_utils.set_backend(args.stft_backend, inference.get_device(args.gpu))
 
     cache_dir = 'sr{}_hl{}_nf{}'.format(args.sr, args.hop_length, args.n_fft)
     filelist = dataset.raw_data_split(
@@ -47,8 +63,10 @@ def main():
         split_mode=args.split_mode
     )
 
-    sp = inference.Separator(model, device, args.batchsize, args.cropsize)
-
+    # mixture and instruments of a pair, and the next pairs, are decoded in parallel
+    waves = decode.iter_decoded(
+        [path for pair in filelist for path in pair], args.sr, workers=args.decode_workers
+    )
     for mix_path, inst_path in filelist:
         X_basename = os.path.splitext(os.path.basename(mix_path))[0]
         y_basename = os.path.splitext(os.path.basename(inst_path))[0]
@@ -72,10 +90,8 @@ def main():
         os.makedirs(pv_cache_dir, exist_ok=True)
         os.makedirs(pi_cache_dir, exist_ok=True)
 
-        X, sr = librosa.load(
-            mix_path, sr=args.sr, mono=False, dtype=np.float32, res_type='kaiser_fast')
-        y, sr = librosa.load(
-            inst_path, sr=args.sr, mono=False, dtype=np.float32, res_type='kaiser_fast')
+        _, X, sr = next(waves)
+        _, y, sr = next(waves)
 
         if X.ndim == 1:
             # mono to stereo
@@ -99,9 +115,9 @@ def main():
         # wave = spec_utils.spectrogram_to_wave(pi, hop_length=args.hop_length)
         # sf.write('{}/{}.wav'.format(pi_dir, pi_basename), wave.T, sr)
 
-        np.save('{}/{}.npy'.format(X_cache_dir, X_basename), X.transpose(2, 0, 1))
-        np.save('{}/{}.npy'.format(y_cache_dir, y_basename), y.transpose(2, 0, 1))
-        np.save('{}/{}.npy'.format(pv_cache_dir, pv_basename), pv.transpose(2, 0, 1))
+        spec_utils.save_cache('{}/{}.npy'.format(X_cache_dir, X_basename), X.transpose(2, 0, 1), args.cache_format)
+        spec_utils.save_cache('{}/{}.npy'.format(y_cache_dir, y_basename), y.transpose(2, 0, 1), args.cache_format)
+        spec_utils.save_cache('{}/{}.npy'.format(pv_cache_dir, pv_basename), pv.transpose(2, 0, 1), args.cache_format)
         # np.save('{}/{}.npy'.format(pi_cache_dir, pi_basename), pi.transpose(2, 0, 1))
 
 
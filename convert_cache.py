@@ -0,0 +1,47 @@
+import argparse
+import glob
+import os
+
+import numpy as np
+from tqdm import tqdm
+
+from lib import spec_utils
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument('--dataset', '-d', required=True)
+    p.add_argument('--cache_format', type=str, choices=spec_utils.CACHE_FORMATS, required=True)
+    p.add_argument('--sr', '-r', type=int, default=44100)
+    p.add_argument('--n_fft', '-f', type=int, default=2048)
+    p.add_argument('--hop_length', '-H', type=int, default=1024)
+    args = p.parse_args()
+
+    cache_dir = 'sr{}_hl{}_nf{}'.format(args.sr, args.hop_length, args.n_fft)
+    paths = sorted(glob.glob(os.path.join(args.dataset, '**', cache_dir, '*.npy'), recursive=True))
+    if len(paths) == 0:
+        raise FileNotFoundError('no {} caches found in {}'.format(cache_dir, args.dataset))
+
+    before = after = 0
+    for path in tqdm(paths):
+        before += os.path.getsize(path)
+        # from the sidecar (written first if missing)
+        cache_format = spec_utils.read_cache_meta(path)['format']
+        if cache_format == args.cache_format:
+            after += os.path.getsize(path)
+            continue
+        if cache_format == 'mag16':
+            raise ValueError('{} only has magnitudes, it cannot be converted to {}'.format(path, args.cache_format))
+
+        # read into memory, not memory-mapped: Windows cannot replace a file
+        # that is still mapped. save_cache writes a temporary file next to it
+        # and replaces the cache with it.
+        spec = spec_utils.decode_cache(np.load(path))
+        spec_utils.save_cache(path, spec, args.cache_format)
+        after += os.path.getsize(path)
+
+    print('{} caches: {:.1f} MB -> {:.1f} MB'.format(len(paths), before / 1024 ** 2, after / 1024 ** 2))
+
+
+if __name__ == '__main__':
+    main()
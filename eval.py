@@ -1,12 +1,14 @@
 import argparse
+import copy
 import os
+import time
 
-import librosa
 import museval
 import numpy as np
-import torch
 
-from lib import nets
+from lib import decode
+from lib import quantize
+from lib import remote
 from lib import spec_utils
 
 import inference
@@ -16,91 +18,164 @@ MODEL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'models')
 DEFAULT_MODEL_PATH = os.path.join(MODEL_DIR, 'baseline.pth')
 
 
+def evaluate(sp, X_spec, y, vocals, hop_length, tta=False):
+    start = time.perf_counter()
+    if tta:
+        y_spec, v_spec = sp.separate_tta(X_spec)
+    else:
+        y_spec, v_spec = sp.separate(X_spec)
+    elapsed = time.perf_counter() - start
+
+    y_wave = spec_utils.spectrogram_to_wave(y_spec, hop_length=hop_length)
+    v_wave = spec_utils.spectrogram_to_wave(v_spec, hop_length=hop_length)
+
+    SDR, ISR, SIR, SAR = museval.evaluate(
+        [y.T, vocals.T], [y_wave.T, v_wave.T]
+    )
+
+    sdr = np.nanmean(SDR, axis=1)
+    isr = np.nanmean(ISR, axis=1)
+    sir = np.nanmean(SIR, axis=1)
+    sar = np.nanmean(SAR, axis=1)
+
+    return [sdr, isr, sir, sar], elapsed
+
+
+def count_parameters(model):
+    if not hasattr(model, 'parameters'):
+        # remote or exported model
+        return '-'
+
+    return sum(p.numel() for p in model.parameters())
+
+
 def main():
     p = argparse.ArgumentParser()
     p.add_argument('--gpu', '-g', type=int, default=-1)
-    p.add_argument('--pretrained_model', '-P', type=str, default=DEFAULT_MODEL_PATH)
+    p.add_argument('--pretrained_model', '-P', type=str, nargs='+', default=[DEFAULT_MODEL_PATH], help='several checkpoints are compared in one table')
     p.add_argument('--input', '-i', required=True)
     p.add_argument('--sr', '-r', type=int, default=44100)
     p.add_argument('--n_fft', '-f', type=int, default=2048)
     p.add_argument('--hop_length', '-H', type=int, default=1024)
-    p.add_argument('--batchsize', '-B', type=int, default=4)
-    p.add_argument('--cropsize', '-c', type=int, default=256)
+    p.add_argument('--batchsize', '-B', type=int, default=None, help='default: autotune.py profile, or 4')
+    p.add_argument('--cropsize', '-c', type=int, default=None, help='default: autotune.py profile, or 256')
     p.add_argument('--output_image', '-I', action='store_true')
     p.add_argument('--tta', '-t', action='store_true')
     p.add_argument('--output_dir', '-o', type=str, default="")
     p.add_argument('--complex', '-X', action='store_true')
+    p.add_argument('--decode_workers', type=int, default=4)
+    p.add_argument('--stft_backend', type=str, choices=list(spec_utils.BACKENDS), default='librosa')
+    p.add_argument('--server', '-s', type=str, default=None, help='separation_server.py address (host:port)')
+    p.add_argument('--precision', type=str, choices=quantize.PRECISIONS, default='fp32')
+    p.add_argument('--calibration', type=str, default=None, help='songs for static int8 quantization of the convolutions')
+    p.add_argument('--calibration_patches', type=int, default=16)
+    p.add_argument('--compare_fp32', action='store_true', help='also evaluate in fp32 and report the difference')
+    p.add_argument('--silence_threshold', type=float, default=None, help='skip patches this many dB (e.g. -80) below the loudest bin')
     args = p.parse_args()
 
-    print('loading model...', end=' ')
-    device = torch.device('cpu')
-    if args.gpu >= 0:
-        if torch.cuda.is_available():
-            device = torch.device('cuda:{}'.format(args.gpu))
-        elif torch.backends.mps.is_available() and torch.backends.mps.is_built():
-            device = torch.device('mps')
-    model = nets.CascadedNet(args.n_fft, args.hop_length, 32, 128, args.complex)
-    model.load_state_dict(torch.load(args.pretrained_model, map_location='cpu'))
-    model.to(device)
-    print('done')
-
-    sp = inference.Separator(
-        model=model,
-        device=device,
-        batchsize=args.batchsize,
-        cropsize=args.cropsize
-    )
+    if args.server is not None and args.precision != 'fp32':
+        p.error('--precision is not supported with --server')
+    if len(args.pretrained_model) > 1 and (args.server is not None or args.compare_fp32):
+        p.error('several models are not supported with --server or --compare_fp32')
 
-    all = []
-    dirs = os.listdir(args.input)
-    for dir in dirs:
-        print(dir, end=' ')
-        dir = os.path.join(args.input, dir)
-        bass, _ = librosa.load(
-            os.path.join(dir, 'bass.wav'), sr=args.sr, mono=False, dtype=np.float32, res_type='kaiser_best'
+    separators = []
+    if args.server is not None:
+        sp = remote.SeparationClient(
+            args.server, args.pretrained_model[0], args.gpu, args.n_fft, args.hop_length,
+            args.batchsize, args.cropsize, args.complex, silence_threshold=args.silence_threshold
         )
-        drums, _ = librosa.load(
-            os.path.join(dir, 'drums.wav'), sr=args.sr, mono=False, dtype=np.float32, res_type='kaiser_best'
-        )
-        other, _ = librosa.load(
-            os.path.join(dir, 'other.wav'), sr=args.sr, mono=False, dtype=np.float32, res_type='kaiser_best'
+        separators.append((args.precision, sp))
+        models = []
+    else:
+        models = args.pretrained_model
+
+    for pretrained_model in models:
+        print('loading model...', end=' ')
+        device = inference.get_device(args.gpu)
+        model = inference.load_model(pretrained_model, args.n_fft, args.hop_length, args.complex, device)
+        print('done')
+
+        if args.compare_fp32 and args.precision != 'fp32':
+            sp_fp32 = inference.Separator(
+                model=copy.deepcopy(model),
+                device=device,
+                batchsize=args.batchsize,
+                cropsize=args.cropsize
+            )
+            separators.append(('fp32', sp_fp32))
+
+        calibration = inference.resolve_inputs(args.calibration) if args.calibration is not None else []
+        model = inference.apply_precision(
+            model, args.precision, device, calibration, args.sr, args.batchsize, args.cropsize,
+            args.calibration_patches
         )
-        vocals, _ = librosa.load(
-            os.path.join(dir, 'vocals.wav'), sr=args.sr, mono=False, dtype=np.float32, res_type='kaiser_best'
+        sp = inference.Separator(
+            model=model,
+            device=device,
+            batchsize=args.batchsize,
+            cropsize=args.cropsize,
+            precision=args.precision,
+            silence_threshold=args.silence_threshold
         )
+
+        name = args.precision
+        if len(args.pretrained_model) > 1:
+            name = os.path.splitext(os.path.basename(pretrained_model))[0]
+        separators.append((name, sp))
+
+    spec_utils.set_backend(args.stft_backend, inference.get_device(args.gpu))
+
+    all = {name: [] for name, _ in separators}
+    elapsed = {name: 0 for name, _ in separators}
+    duration = 0
+    dirs = os.listdir(args.input)
+    stems = ['bass.wav', 'drums.wav', 'other.wav', 'vocals.wav']
+    # the stems of this track and the next ones are decoded in parallel
+    waves = decode.iter_decoded(
+        [os.path.join(args.input, dir, stem) for dir in dirs for stem in stems],
+        args.sr, res_type='kaiser_best', workers=args.decode_workers, prefetch=len(stems)
+    )
+    for dir in dirs:
+        print(dir, end=' ')
+        bass, drums, other, vocals = [next(waves)[1] for _ in stems]
         y = bass + drums + other
         X = y + vocals
+        duration += X.shape[1] / args.sr
         print('done')
 
         print('stft of wave source...', end=' ')
         X_spec = spec_utils.wave_to_spectrogram(X, args.hop_length, args.n_fft)
         print('done')
 
-        if args.tta:
-            y_spec, v_spec = sp.separate_tta(X_spec)
-        else:
-            y_spec, v_spec = sp.separate(X_spec)
-
-        y_wave = spec_utils.spectrogram_to_wave(y_spec, hop_length=args.hop_length)
-        v_wave = spec_utils.spectrogram_to_wave(v_spec, hop_length=args.hop_length)
-
-        SDR, ISR, SIR, SAR = museval.evaluate(
-            [y.T, vocals.T], [y_wave.T, v_wave.T]
-        )
-
-        sdr = np.nanmean(SDR, axis=1)
-        isr = np.nanmean(ISR, axis=1)
-        sir = np.nanmean(SIR, axis=1)
-        sar = np.nanmean(SAR, axis=1)
-
-        print(sdr)
-        print(isr)
-        print(sir)
-        print(sar)
-
-        all.append([sdr, isr, sir, sar])
-
-    print(np.asarray(all).mean(axis=0))
+        for name, sp in separators:
+            scores, t = evaluate(sp, X_spec, y, vocals, args.hop_length, args.tta)
+            elapsed[name] += t
+
+            if len(separators) > 1:
+                print(name)
+            for score in scores:
+                print(score)
+
+            all[name].append(scores)
+
+    for name, _ in separators:
+        if len(separators) > 1:
+            print('{} ({:.1f} sec)'.format(name, elapsed[name]))
+        print(np.asarray(all[name]).mean(axis=0))
+
+    if args.compare_fp32 and args.precision != 'fp32':
+        # [sdr, isr, sir, sar] x [instruments, vocals] relative to fp32
+        print('difference from fp32 (speedup x{:.2f})'.format(elapsed['fp32'] / elapsed[args.precision]))
+        print(np.asarray(all[args.precision]).mean(axis=0) - np.asarray(all['fp32']).mean(axis=0))
+
+    # real-time factor (separation time / audio duration) against the mean SDR
+    print('{:<24} {:>10} {:>7} {:>10} {:>10}'.format('model', 'parameters', 'RTF', 'SDR inst', 'SDR vocals'))
+    for name, sp in separators:
+        params = count_parameters(getattr(sp, 'model', None))
+        sdr = np.asarray(all[name]).mean(axis=0)[0]
+        print('{:<24} {:>10} {:>7.3f} {:>10.3f} {:>10.3f}'.format(
+            name, params, elapsed[name] / duration, sdr[0], sdr[1]
+        ))
 
 
 if __name__ == '__main__':
@@ -0,0 +1,54 @@
+import argparse
+import os
+import sys
+
+import inference
+from lib import export
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument('--pretrained_model', '-P', type=str, default=inference.DEFAULT_MODEL_PATH)
+    p.add_argument('--n_fft', '-f', type=int, default=None, help='default: from the checkpoint')
+    p.add_argument('--hop_length', '-H', type=int, default=None, help='default: from the checkpoint')
+    p.add_argument('--complex', '-X', action='store_true', default=None)
+    p.add_argument('--format', '-F', type=str, choices=list(export.EXPORT_FORMATS), default='torchscript')
+    p.add_argument('--output', '-o', type=str, default=None)
+    p.add_argument('--batchsize', '-B', type=int, default=4, help='batch size used for tracing')
+    p.add_argument('--cropsize', '-c', type=int, default=256, help='patch width used for tracing')
+    p.add_argument('--tolerance', type=float, default=1e-4, help='max abs mask difference allowed by the parity check')
+    args = p.parse_args()
+
+    output = args.output
+    if output is None:
+        output = os.path.splitext(args.pretrained_model)[0] + export.EXPORT_FORMATS[args.format]
+
+    print('loading model...', end=' ')
+    # unfused, so the parity check also covers the BatchNorm folding
+    model = inference.load_model(
+        args.pretrained_model, args.n_fft, args.hop_length, args.complex, fuse=False
+    )
+    model.eval()
+    print('done')
+
+    print('exporting {} model to {}...'.format(args.format, output), end=' ')
+    export.export_model(model, output, args.format, args.batchsize, args.cropsize)
+    print('done')
+
+    print('checking parity with the eager model...', end=' ')
+    exported = export.load_exported(output)
+    diff = max(
+        export.parity_check(model, exported, args.batchsize, args.cropsize),
+        # a partial last batch and a different patch width must work too
+        export.parity_check(model, exported, 1, args.cropsize + 64)
+    )
+    print('done')
+    print('max abs mask difference: {:.3g}'.format(diff))
+
+    if diff > args.tolerance:
+        print('parity check failed, the exported model does not match the eager model')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
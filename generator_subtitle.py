@@ -1,24 +1,11 @@
 from faster_whisper import WhisperModel
 from opencc import OpenCC
 from tqdm import tqdm
+from concurrent.futures import ThreadPoolExecutor
 import argparse
+import os
 
 
-# 設定模型與檔案路徑
-model = WhisperModel("medium", compute_type="int8")  # 你可換成 tiny 或 medium
-cc = OpenCC('s2t')
-parser = argparse.ArgumentParser()
-parser.add_argument("--input", "-i", required=True, help="人聲音訊檔 (.wav)")
-parser.add_argument("--output", "-o", required=True, help="輸出字幕檔 (.srt)")
-args = parser.parse_args()
-
-input_audio = args.input
-output_srt = args.output
-
-# 執行轉錄
-print("🎙️ 開始轉錄音訊（含逐字時間）...")
-segments, _ = model.transcribe(input_audio, word_timestamps=True)
-
 # 格式化時間
 def format_timestamp(seconds):
     hrs = int(seconds // 3600)
@@ -27,15 +14,85 @@ def format_timestamp(seconds):
     millis = int((seconds % 1) * 1000)
     return f"{hrs:02}:{mins:02}:{secs:02},{millis:03}"
 
-# 寫入 .srt
-with open(output_srt, "w", encoding="utf-8") as f:
-    for i, segment in enumerate(tqdm(segments, desc="📝 生成逐字 SRT")):
-        words = segment.words
-        if not words:
-            continue
-        start = format_timestamp(words[0].start)  # 🎯 以第一個字的時間為起點
-        end = format_timestamp(words[-1].end)
-        text = cc.convert("".join([w.word for w in words]).strip())
-        f.write(f"{i+1}\n{start} --> {end}\n{text}\n\n")
-
-print(f"✅ 精確逐字字幕儲存至：{output_srt}")
\ No newline at end of file
+
+# 模型只在建立時載入一次，之後可以重複轉錄多首歌
+class Transcriber(object):
+    def __init__(
+            self, model_size="medium", compute_type="int8", device="auto",
+            cpu_threads=0, num_workers=1, vad_filter=True):
+        # model_size 可換成 tiny / base / small / medium / large-v3
+        # cpu_threads=0 交給 CTranslate2 自己決定；num_workers > 1 時可以同時轉錄多首
+        self.model = WhisperModel(
+            model_size, device=device, compute_type=compute_type,
+            cpu_threads=cpu_threads, num_workers=num_workers
+        )
+        self.num_workers = num_workers
+        self.vad_filter = vad_filter
+        self.cc = OpenCC('s2t')
+
+    # audio 可以是檔案路徑，或 16 kHz 單聲道 float32 的 numpy array
+    # progress(fraction) 依目前段落的結束時間 / 音訊總長回報進度
+    def transcribe(self, audio, output_srt, progress=None):
+        # 執行轉錄；分離後的人聲在間奏處幾乎是靜音，用 VAD 直接跳過
+        print("🎙️ 開始轉錄音訊（含逐字時間）...")
+        segments, info = self.model.transcribe(
+            audio, word_timestamps=True, vad_filter=self.vad_filter,
+            vad_parameters=dict(min_silence_duration_ms=500)
+        )
+
+        # 寫入 .srt
+        with open(output_srt, "w", encoding="utf-8") as f:
+            for i, segment in enumerate(tqdm(segments, desc="📝 生成逐字 SRT")):
+                if progress is not None and info.duration > 0:
+                    progress(min(segment.end / info.duration, 1.0))
+                words = segment.words
+                if not words:
+                    continue
+                start = format_timestamp(words[0].start)  # 🎯 以第一個字的時間為起點
+                end = format_timestamp(words[-1].end)
+                text = self.cc.convert("".join([w.word for w in words]).strip())
+                f.write(f"{i+1}\n{start} --> {end}\n{text}\n\n")
+
+        if progress is not None:
+            progress(1.0)
+        print(f"✅ 精確逐字字幕儲存至：{output_srt}")
+        return output_srt
+
+    # jobs 為 (audio, output_srt) 的列表，依 num_workers 同時轉錄
+    def transcribe_many(self, jobs):
+        with ThreadPoolExecutor(max_workers=self.num_workers) as pool:
+            return list(pool.map(lambda job: self.transcribe(*job), jobs))
+
+
+def subtitle_path(audio_path, output_dir=None):
+    basename = os.path.splitext(os.path.basename(audio_path))[0]
+    if basename.endswith("_Vocals"):
+        basename = basename[:-len("_Vocals")]
+    return os.path.join(output_dir or os.path.dirname(audio_path), f"{basename}_subtitle.srt")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--input", "-i", required=True, nargs="+", help="人聲音訊檔 (.wav)，可一次給多個")
+    parser.add_argument("--output", "-o", default=None, help="輸出字幕檔 (.srt)，只給一個輸入時使用")
+    parser.add_argument("--output_dir", "-d", default=None, help="多個輸入時的字幕輸出資料夾，預設與音訊相同")
+    parser.add_argument("--model", "-m", default="medium", help="Whisper 模型大小")
+    parser.add_argument("--compute_type", default="int8")
+    parser.add_argument("--device", default="auto", help="cpu / cuda / auto")
+    parser.add_argument("--cpu_threads", type=int, default=0)
+    parser.add_argument("--num_workers", type=int, default=1, help="同時轉錄的數量")
+    parser.add_argument("--no_vad", action="store_true", help="不使用 VAD 跳過靜音段落")
+    args = parser.parse_args()
+
+    if args.output is not None and len(args.input) > 1:
+        parser.error("--output 只能搭配單一輸入，多個輸入請用 --output_dir")
+
+    transcriber = Transcriber(
+        args.model, compute_type=args.compute_type, device=args.device,
+        cpu_threads=args.cpu_threads, num_workers=args.num_workers, vad_filter=not args.no_vad
+    )
+    if args.output is not None:
+        outputs = [args.output]
+    else:
+        outputs = [subtitle_path(path, args.output_dir) for path in args.input]
+    transcriber.transcribe_many(list(zip(args.input, outputs)))
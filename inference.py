@@ -1,28 +1,105 @@
 import argparse
+import glob
+import json
 import os
 
-import librosa
 import numpy as np
 import soundfile as sf
 import torch
 from tqdm import tqdm
 from torchinfo import summary
 
-from lib import dataset
+from lib import autotune
+from lib import decode
+from lib import export
 from lib import nets
+from lib import quantize
+from lib import replicas
+from lib import result_cache
 from lib import spec_utils
 from lib import utils
 
 
+class MaskAccumulator(object):
+
+    def __init__(self, X_spec, cropsize, offset, roi_size, shifts=(0,), weights=None):
+        self.n_frame = X_spec.shape[2]
+        self.cropsize = cropsize
+        self.roi_size = roi_size
+        self.shifts = list(shifts)
+        self.weights = [1.0] * len(shifts) if weights is None else weights
+
+        # A single padded copy serves all shifts: crop i of shift s covers the
+        # frames [i * roi_size - s, (i + 1) * roi_size - s) of the song.
+        self.max_shift = max(shifts)
+        self.n_patches = [int(np.ceil((self.n_frame + shift) / roi_size)) for shift in shifts]
+        pad_l = offset + self.max_shift
+        pad_r = max(
+            (n - 1) * roi_size + self.max_shift - shift + cropsize
+            for n, shift in zip(self.n_patches, shifts)
+        ) - pad_l - self.n_frame
+        self.X_spec_pad = np.pad(X_spec, ((0, 0), (0, 0), (pad_l, pad_r)), mode='constant')
+        self.X_spec_pad /= np.abs(X_spec).max()
+
+        self.mask_sum = None
+        self.weight_sum = np.zeros(self.n_frame, dtype=np.float32)
+
+    def crops(self, j, patches=None):
+        if patches is None:
+            patches = range(self.n_patches[j])
+
+        for i in patches:
+            start = i * self.roi_size + self.max_shift - self.shifts[j]
+            yield (j, i), self.X_spec_pad[:, :, start:start + self.cropsize]
+
+    def frame_range(self, j, i):
+        start = i * self.roi_size - self.shifts[j]
+        return start, max(start, 0), min(start + self.roi_size, self.n_frame)
+
+    def add(self, j, i, mask):
+        if self.mask_sum is None:
+            self.mask_sum = np.zeros(mask.shape[:2] + (self.n_frame,), dtype=mask.dtype)
+
+        start, a, b = self.frame_range(j, i)
+        self.mask_sum[:, :, a:b] += self.weights[j] * mask[:, :, a - start:b - start]
+        self.weight_sum[a:b] += self.weights[j]
+
+    def mask(self):
+        return self.mask_sum / self.weight_sum
+
+
 class Separator(object):
 
-    def __init__(self, model, device=None, batchsize=1, cropsize=256):
+    def __init__(
+            self, model, device=None, batchsize=None, cropsize=None,
+            tta_shifts=2, tta_weights=None, cheap_tta=False, tta_threshold=0.2, progress=None,
+            precision='fp32', pool=None, silence_threshold=None):
         self.model = model
         self.offset = model.offset
         self.device = device
+        if batchsize is None or cropsize is None:
+            # the setting found by autotune.py for this model and device, if any
+            tuned = autotune.lookup(model, device) or {}
+            batchsize = batchsize or tuned.get('batchsize', autotune.DEFAULT_BATCHSIZE)
+            cropsize = cropsize or tuned.get('cropsize', autotune.DEFAULT_CROPSIZE)
         self.batchsize = batchsize
         self.cropsize = cropsize
         self.is_complex = model.is_complex
+        self.tta_shifts = tta_shifts
+        self.tta_weights = tta_weights
+        self.cheap_tta = cheap_tta
+        self.tta_threshold = tta_threshold
+        # called as progress(done, total) after every batch, total may be None
+        self.progress = progress
+        # bf16 runs the network under autocast, int8 is applied to the model by apply_precision
+        self.precision = precision
+        # lib.replicas.ReplicaPool, spreads the batches over pinned model replicas
+        self.pool = pool
+        # patches whose loudest frame is this many dB below the loudest bin of
+        # the song get an all-instruments mask without a forward pass
+        self.silence_threshold = silence_threshold
+        self.n_patches = 0
+        self.n_skipped = 0
 
     def _postprocess(self, X_spec, mask):
         if self.is_complex:
@@ -37,157 +114,675 @@ class Separator(object):
 
         return y_spec, v_spec
 
-    def _separate(self, X_spec_pad, roi_size):
-        X_dataset = []
-        patches = (X_spec_pad.shape[2] - 2 * self.offset) // roi_size
-        for i in range(patches):
-            start = i * roi_size
-            X_spec_crop = X_spec_pad[:, :, start:start + self.cropsize]
-            X_dataset.append(X_spec_crop)
+    def _run_batch(self, X_batch):
+        X_batch = torch.from_numpy(np.asarray(X_batch)).to(self.device)
 
-        X_dataset = np.asarray(X_dataset)
+        if not self.is_complex:
+            X_batch = torch.abs(X_batch)
 
-        self.model.eval()
-        with torch.no_grad():
-            mask_list = []
-            # To reduce the overhead, dataloader is not used.
-            for i in tqdm(range(0, patches, self.batchsize)):
-                X_batch = X_dataset[i: i + self.batchsize]
-                X_batch = torch.from_numpy(X_batch).to(self.device)
+        device_type = X_batch.device.type
+        with torch.no_grad(), torch.autocast(
+                device_type, dtype=torch.bfloat16, enabled=self.precision == 'bf16'):
+            mask = self.model.predict_mask(X_batch)
 
-                if not self.is_complex:
-                    X_batch = torch.abs(X_batch)
+        # complex masks are built in fp32 (see nets.CascadedNet.forward)
+        mask = mask.detach() if mask.is_complex() else mask.detach().float()
 
-                mask = self.model.predict_mask(X_batch)
+        return mask.cpu().numpy()
 
-                mask = mask.detach().cpu().numpy()
-                mask = np.concatenate(mask, axis=2)
-                mask_list.append(mask)
+    def _is_silent(self, crop):
+        # crops are normalized by the magnitude of the loudest bin of the song
+        power = np.mean(np.abs(crop) ** 2, axis=(0, 1))
+        return 10 * np.log10(power.max() + 1e-20) < self.silence_threshold
 
-            mask = np.concatenate(mask_list, axis=2)
+    def _silent_mask(self, crop):
+        mask = np.zeros((4, crop.shape[1], self._roi_size()), dtype=np.complex64 if self.is_complex else np.float32)
+        mask[:2] = 1
 
         return mask
 
-    def separate(self, X_spec):
-        n_frame = X_spec.shape[2]
-        pad_l, pad_r, roi_size = dataset.make_padding(n_frame, self.cropsize, self.offset)
-        X_spec_pad = np.pad(X_spec, ((0, 0), (0, 0), (pad_l, pad_r)), mode='constant')
-        X_spec_pad /= np.abs(X_spec).max()
+    def _batches(self, crops, skipped):
+        keys, X_batch = [], []
+        for key, crop in crops:
+            self.n_patches += 1
+            if self.silence_threshold is not None and self._is_silent(crop):
+                self.n_skipped += 1
+                skipped.append((key, self._silent_mask(crop)))
+                continue
+
+            keys.append(key)
+            X_batch.append(crop)
+
+            if len(X_batch) == self.batchsize:
+                yield keys, X_batch
+                keys, X_batch = [], []
+
+        if len(X_batch) > 0:
+            yield keys, X_batch
+
+    def _predict(self, crops, total=None):
+        # Batches crops coming from any number of sources (shifts, songs) and
+        # yields (key, mask) for every crop in order.
+        # To reduce the overhead, dataloader is not used.
+        self.model.eval()
 
-        mask = self._separate(X_spec_pad, roi_size)
-        mask = mask[:, :, :n_frame]
+        # silent crops are set aside while the batches are built and yielded
+        # right after the next batch, so they may come out of order
+        skipped = []
+        if self.pool is not None:
+            results = self.pool.imap(self._batches(crops, skipped))
+        else:
+            results = ((keys, self._run_batch(X_batch)) for keys, X_batch in self._batches(crops, skipped))
+
+        with tqdm(total=total) as pbar:
+            for keys, mask in results:
+                yield from zip(keys, mask)
+                self._update_progress(pbar, len(keys))
+
+                while len(skipped) > 0:
+                    yield skipped.pop(0)
+                    self._update_progress(pbar, 1)
+
+            while len(skipped) > 0:
+                yield skipped.pop(0)
+                self._update_progress(pbar, 1)
+
+    def _report_skipped(self):
+        if self.silence_threshold is not None:
+            print('skipped {} of {} patches below {} dB'.format(
+                self.n_skipped, self.n_patches, self.silence_threshold
+            ))
+        self.n_patches = self.n_skipped = 0
+
+    def _update_progress(self, pbar, n):
+        pbar.update(n)
+        if self.progress is not None:
+            self.progress(pbar.n, pbar.total)
+
+    def _roi_size(self):
+        roi_size = self.cropsize - self.offset * 2
+        if roi_size == 0:
+            roi_size = self.cropsize
+
+        return roi_size
+
+    def _uncertainty(self, mask):
+        # 1 where the instrument/vocal decision is a coin flip, 0 where it is certain
+        if self.is_complex:
+            mask = np.abs(mask)
+
+        return np.mean(1 - np.abs(2 * mask - 1))
+
+    def _accumulator(self, X_spec, shifts=(0,), weights=None):
+        return MaskAccumulator(X_spec, self.cropsize, self.offset, self._roi_size(), shifts, weights)
+
+    def _separate(self, X_spec, shifts=(0,), weights=None, cheap=False):
+        acc = self._accumulator(X_spec, shifts, weights)
+
+        if cheap and len(shifts) > 1:
+            # Run the first shift everywhere, the others only on patches that
+            # overlap a region whose mask is uncertain.
+            uncertain = np.zeros(acc.n_patches[0], dtype=bool)
+            for (j, i), mask in self._predict(acc.crops(0), acc.n_patches[0]):
+                acc.add(j, i, mask)
+                uncertain[i] = self._uncertainty(mask) > self.tta_threshold
+
+            def is_uncertain(j, i):
+                _, a, b = acc.frame_range(j, i)
+                return uncertain[a // acc.roi_size:(b - 1) // acc.roi_size + 1].any()
+
+            extra_crops = (
+                crop for j in range(1, len(shifts))
+                for crop in acc.crops(j, [i for i in range(acc.n_patches[j]) if is_uncertain(j, i)])
+            )
+            for (j, i), mask in self._predict(extra_crops):
+                acc.add(j, i, mask)
+        else:
+            all_crops = (crop for j in range(len(shifts)) for crop in acc.crops(j))
+            for (j, i), mask in self._predict(all_crops, sum(acc.n_patches)):
+                acc.add(j, i, mask)
 
-        y_spec, v_spec = self._postprocess(X_spec, mask)
+        self._report_skipped()
 
-        return y_spec, v_spec
+        return acc.mask()
 
-    def separate_tta(self, X_spec):
-        n_frame = X_spec.shape[2]
-        pad_l, pad_r, roi_size = dataset.make_padding(n_frame, self.cropsize, self.offset)
-        X_spec_pad = np.pad(X_spec, ((0, 0), (0, 0), (pad_l, pad_r)), mode='constant')
-        X_spec_pad /= X_spec_pad.max()
+    def tta_shift_list(self):
+        roi_size = self._roi_size()
+        return [k * roi_size // self.tta_shifts for k in range(self.tta_shifts)]
 
-        mask = self._separate(X_spec_pad, roi_size)
+    def separate(self, X_spec):
+        mask = self._separate(X_spec)
 
-        pad_l += roi_size // 2
-        pad_r += roi_size // 2
-        X_spec_pad = np.pad(X_spec, ((0, 0), (0, 0), (pad_l, pad_r)), mode='constant')
-        X_spec_pad /= X_spec_pad.max()
+        y_spec, v_spec = self._postprocess(X_spec, mask)
 
-        mask_tta = self._separate(X_spec_pad, roi_size)
-        mask_tta = mask_tta[:, :, roi_size // 2:]
+        return y_spec, v_spec
 
-        mask = (mask[:, :, :n_frame] + mask_tta[:, :, :n_frame]) * 0.5
+    def separate_tta(self, X_spec):
+        mask = self._separate(
+            X_spec,
+            shifts=self.tta_shift_list(),
+            weights=self.tta_weights,
+            cheap=self.cheap_tta
+        )
 
         y_spec, v_spec = self._postprocess(X_spec, mask)
 
         return y_spec, v_spec
 
+    def separate_many(self, specs, tta=False):
+        # Packs the crops of consecutive songs into the same batches, so only
+        # the very last batch can be partly empty. (key, y_spec, v_spec) is
+        # yielded as soon as all patches of a song are done.
+        shifts = self.tta_shift_list() if tta else [0]
+        weights = self.tta_weights if tta else None
+        pending = {}
+
+        def crops():
+            for key, X_spec in specs:
+                acc = self._accumulator(X_spec, shifts, weights)
+                pending[key] = [X_spec, acc, sum(acc.n_patches)]
+                for j in range(len(shifts)):
+                    for (_, i), crop in acc.crops(j):
+                        yield (key, j, i), crop
+
+        for (key, j, i), mask in self._predict(crops()):
+            entry = pending[key]
+            entry[1].add(j, i, mask)
+            entry[2] -= 1
+
+            if entry[2] == 0:
+                X_spec, acc, _ = pending.pop(key)
+                y_spec, v_spec = self._postprocess(X_spec, acc.mask())
+                yield key, y_spec, v_spec
+
+        self._report_skipped()
+
+    def separate_stream(self, spec_chunks, coef):
+        # Consumes spectrogram frames chunk by chunk and yields the separated
+        # frames as soon as the patches covering them have been processed.
+        # Only `cropsize + batchsize * roi_size` frames are kept in memory.
+        roi_size = self._roi_size()
+
+        self.model.eval()
+
+        buf = None
+        buf_start = -self.offset  # frame index of buf[:, :, 0], the left padding is negative
+        n_frame = 0
+        next_start = -self.offset
+        crops = []
+
+        def run(crops):
+            X_batch = np.asarray([crop for crop, _ in crops])
+            X_batch /= coef
+            mask = self._run_batch(X_batch)
+
+            for (_, X_roi), mask_roi in zip(crops, mask):
+                yield self._postprocess(X_roi, mask_roi[:, :, :X_roi.shape[2]])
+
+        def collect(final):
+            nonlocal buf, buf_start, next_start
+            while True:
+                end = next_start + self.cropsize
+                if not final and buf_start + buf.shape[2] < end:
+                    return
+                if final and next_start + self.offset >= n_frame:
+                    return
+
+                if buf_start + buf.shape[2] < end:
+                    pad = end - buf_start - buf.shape[2]
+                    buf = np.pad(buf, ((0, 0), (0, 0), (0, pad)), mode='constant')
+
+                crop = buf[:, :, next_start - buf_start:end - buf_start]
+                roi_end = min(roi_size, n_frame - next_start - self.offset) if final else roi_size
+                X_roi = crop[:, :, self.offset:self.offset + roi_end]
+                crops.append((crop, X_roi))
+
+                next_start += roi_size
+                buf = buf[:, :, next_start - buf_start:]
+                buf_start = next_start
+
+        for chunk in spec_chunks:
+            if buf is None:
+                buf = np.zeros(chunk.shape[:2] + (self.offset,), dtype=chunk.dtype)
+            buf = np.concatenate([buf, chunk], axis=2)
+            n_frame += chunk.shape[2]
+
+            collect(final=False)
+            while len(crops) >= self.batchsize:
+                yield from run(crops[:self.batchsize])
+                crops = crops[self.batchsize:]
+
+        if buf is None:
+            return
+
+        collect(final=True)
+        for i in range(0, len(crops), self.batchsize):
+            yield from run(crops[i:i + self.batchsize])
+
 
 MODEL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'models')
 DEFAULT_MODEL_PATH = os.path.join(MODEL_DIR, 'baseline.pth')
+INPUT_EXTS = ['.wav', '.m4a', '.mp3', '.mp4', '.flac']
 
 
-def main():
-    p = argparse.ArgumentParser()
-    p.add_argument('--gpu', '-g', type=int, default=-1)
-    p.add_argument('--pretrained_model', '-P', type=str, default=DEFAULT_MODEL_PATH)
-    p.add_argument('--input', '-i', required=True)
-    p.add_argument('--sr', '-r', type=int, default=44100)
-    p.add_argument('--n_fft', '-f', type=int, default=2048)
-    p.add_argument('--hop_length', '-H', type=int, default=1024)
-    p.add_argument('--batchsize', '-B', type=int, default=4)
-    p.add_argument('--cropsize', '-c', type=int, default=256)
-    p.add_argument('--output_image', '-I', action='store_true')
-    p.add_argument('--tta', '-t', action='store_true')
-    p.add_argument('--output_dir', '-o', type=str, default="output", help="Output directory")
-    p.add_argument('--complex', '-X', action='store_true')
-    args = p.parse_args()
-
-    print('loading model...', end=' ')
+def get_device(gpu):
     device = torch.device('cpu')
-    if args.gpu >= 0:
+    if gpu >= 0:
         if torch.cuda.is_available():
-            device = torch.device('cuda:{}'.format(args.gpu))
+            device = torch.device('cuda:{}'.format(gpu))
         elif torch.backends.mps.is_available() and torch.backends.mps.is_built():
             device = torch.device('mps')
-    model = nets.CascadedNet(args.n_fft, args.hop_length, 32, 128, args.complex)
-    model.load_state_dict(torch.load(args.pretrained_model, map_location='cpu'))
-    model.to(device)
-    #summary(model)
-    print('done')
 
-    print('loading wave source...', end=' ')
-    X, sr = librosa.load(
-        args.input, sr=args.sr, mono=False, dtype=np.float32, res_type='kaiser_fast'
-    )
-    basename = os.path.splitext(os.path.basename(args.input))[0]
-    print('done')
+    return device
+
 
+def load_model(pretrained_model, n_fft=None, hop_length=None, is_complex=None, device=None, fuse=True):
+    # n_fft, hop_length and is_complex are checked against the model when given
+    if export.is_exported(pretrained_model):
+        # TorchScript / ONNX artifact written by export_model.py
+        model = export.load_exported(pretrained_model, device)
+    else:
+        # the network size comes from the checkpoint
+        model = nets.load_checkpoint(pretrained_model, n_fft, hop_length, is_complex)
+
+    expected = (n_fft, hop_length, is_complex)
+    actual = (model.n_fft, model.hop_length, model.is_complex)
+    if any(e is not None and e != a for e, a in zip(expected, actual)):
+        raise ValueError('{} was made with n_fft={}, hop_length={}, complex={}'.format(
+            pretrained_model, model.n_fft, model.hop_length, model.is_complex
+        ))
+
+    if export.is_exported(pretrained_model):
+        model.checkpoint_path = pretrained_model
+
+        return model
+
+    if fuse:
+        model.fuse_for_inference()
+    if device is not None:
+        model.to(device)
+    model.checkpoint_path = pretrained_model
+
+    return model
+
+
+def apply_precision(
+        model, precision, device=None, calibration=(), sr=44100, batchsize=None, cropsize=None,
+        calibration_patches=16):
+    # int8: dynamic quantization of the LSTM / Linear layers, plus static
+    # quantization of the conv stacks when calibration songs are given
+    if precision != 'int8':
+        return model
+    if not isinstance(model, nets.CascadedNet):
+        raise ValueError('int8 needs a .pth checkpoint, not an exported model')
+    if device is not None and device.type != 'cpu':
+        raise ValueError('int8 inference runs on CPU only')
+
+    if len(calibration) > 0:
+        quantize.prepare_static(model)
+        sp = Separator(model=model, device=device, batchsize=batchsize, cropsize=cropsize)
+        n_frame = calibration_patches * sp._roi_size()
+        for path in calibration:
+            print('calibrating on {}...'.format(os.path.basename(path)))
+            X, _ = load_wave(path, sr)
+            X_spec = stereo_spectrogram(X, model.n_fft, model.hop_length)
+            # the middle of a song is more representative than its intro
+            start = max(0, (X_spec.shape[2] - n_frame) // 2)
+            sp.separate(X_spec[:, :, start:start + n_frame])
+        quantize.convert_static(model)
+
+    return quantize.quantize_dynamic(model)
+
+
+def to_stereo(X):
     if X.ndim == 1:
         # mono to stereo
         X = np.asarray([X, X])
 
-    print('stft of wave source...', end=' ')
-    X_spec = spec_utils.wave_to_spectrogram(X, args.hop_length, args.n_fft)
-    print('done')
+    return X
 
-    sp = Separator(
-        model=model,
-        device=device,
-        batchsize=args.batchsize,
-        cropsize=args.cropsize
-    )
 
-    if args.tta:
-        y_spec, v_spec = sp.separate_tta(X_spec)
-    else:
-        y_spec, v_spec = sp.separate(X_spec)
+def load_wave(path, sr):
+    X, sr = decode.load_wave(path, sr)
 
-    print('validating output directory...', end=' ')
-    output_dir = args.output_dir
+    return to_stereo(X), sr
+
+
+def stereo_spectrogram(X, n_fft, hop_length):
+    return spec_utils.wave_to_spectrogram(to_stereo(X), hop_length, n_fft)
+
+
+def prepare_output_dir(output_dir):
     if output_dir != "":  # modifies output_dir if theres an arg specified
         output_dir = output_dir.rstrip('/') + '/'
         os.makedirs(output_dir, exist_ok=True)
-    print('done')
+
+    return output_dir
+
+
+def write_stems(y_spec, v_spec, basename, output_dir, sr, hop_length, output_image=False):
+    inst_path = '{}{}_Instruments.wav'.format(output_dir, basename)
+    vocal_path = '{}{}_Vocals.wav'.format(output_dir, basename)
 
     print('inverse stft of instruments...', end=' ')
-    wave = spec_utils.spectrogram_to_wave(y_spec, hop_length=args.hop_length)
+    wave = spec_utils.spectrogram_to_wave(y_spec, hop_length=hop_length)
     print('done')
-    sf.write('{}{}_Instruments.wav'.format(output_dir, basename), wave.T, sr)
+    sf.write(inst_path, wave.T, sr)
 
     print('inverse stft of vocals...', end=' ')
-    wave = spec_utils.spectrogram_to_wave(v_spec, hop_length=args.hop_length)
+    wave = spec_utils.spectrogram_to_wave(v_spec, hop_length=hop_length)
     print('done')
-    sf.write('{}{}_Vocals.wav'.format(output_dir, basename), wave.T, sr)
+    sf.write(vocal_path, wave.T, sr)
 
-    if args.output_image:
+    if output_image:
         image = spec_utils.spectrogram_to_image(y_spec)
         utils.imwrite('{}{}_Instruments.jpg'.format(output_dir, basename), image)
 
         image = spec_utils.spectrogram_to_image(v_spec)
         utils.imwrite('{}{}_Vocals.jpg'.format(output_dir, basename), image)
 
+    return inst_path, vocal_path
+
+
+def stem_cache_key(sp, X, sr, model_hash, n_fft, hop_length, tta=False):
+    return result_cache.cache_key(
+        X, sr, model_hash, n_fft, hop_length, sp.cropsize,
+        [sp.tta_shifts, sp.tta_weights, sp.cheap_tta, sp.tta_threshold if sp.cheap_tta else None] if tta else False,
+        sp.is_complex, sp.silence_threshold
+    )
+
+
+def separate_file(
+        sp, input_path, sr, n_fft, hop_length, tta=False, output_dir='', output_image=False,
+        cache=None, model_hash=None):
+    print('loading wave source...', end=' ')
+    X, sr = decode.load_wave(input_path, sr)
+    basename = os.path.splitext(os.path.basename(input_path))[0]
+    print('done')
+
+    if cache is not None:
+        key = stem_cache_key(sp, X, sr, model_hash, n_fft, hop_length, tta)
+        output_dir = prepare_output_dir(output_dir)
+        inst_path = '{}{}_Instruments.wav'.format(output_dir, basename)
+        vocal_path = '{}{}_Vocals.wav'.format(output_dir, basename)
+        if cache.fetch(key, {'instruments': inst_path, 'vocals': vocal_path}):
+            print('reused cached stems {}'.format(key[:12]))
+            return inst_path, vocal_path
+
+    X = to_stereo(X)
+
+    print('stft of wave source...', end=' ')
+    X_spec = spec_utils.wave_to_spectrogram(X, hop_length, n_fft)
+    print('done')
+
+    if tta:
+        y_spec, v_spec = sp.separate_tta(X_spec)
+    else:
+        y_spec, v_spec = sp.separate(X_spec)
+
+    print('validating output directory...', end=' ')
+    output_dir = prepare_output_dir(output_dir)
+    print('done')
+
+    inst_path, vocal_path = write_stems(y_spec, v_spec, basename, output_dir, sr, hop_length, output_image)
+
+    if cache is not None:
+        cache.put(key, {'instruments': inst_path, 'vocals': vocal_path}, source=basename)
+
+    return inst_path, vocal_path
+
+
+def resolve_inputs(input):
+    # a single file, a directory, a glob pattern or a manifest (.txt with one
+    # path per line, or a .json list of paths)
+    if os.path.isdir(input):
+        return sorted([
+            os.path.join(input, fname)
+            for fname in os.listdir(input)
+            if os.path.splitext(fname)[1].lower() in INPUT_EXTS
+        ])
+    elif os.path.splitext(input)[1] == '.txt':
+        with open(input, 'r', encoding='utf8') as f:
+            return [line.strip() for line in f if line.strip() != '']
+    elif os.path.splitext(input)[1] == '.json':
+        with open(input, 'r', encoding='utf8') as f:
+            return json.load(f)
+    elif glob.has_magic(input):
+        return sorted(glob.glob(input))
+
+    return [input]
+
+
+def separate_files(
+        sp, paths, sr, n_fft, hop_length, tta=False, output_dir='', output_image=False, decode_workers=2,
+        cache=None, model_hash=None):
+    output_dir = prepare_output_dir(output_dir)
+    rates = {}
+    keys = {}
+    order = []
+    outputs = {}
+
+    def transform(X):
+        # the cache key needs the decoded wave, so it is computed in the decode pool too
+        key = stem_cache_key(sp, X, sr, model_hash, n_fft, hop_length, tta) if cache is not None else None
+        return key, stereo_spectrogram(X, n_fft, hop_length)
+
+    def specs():
+        for path, (key, X_spec), sr_ in decode.iter_decoded(
+                paths, sr, workers=decode_workers, prefetch=2, transform=transform):
+            order.append(path)
+            if key is not None:
+                basename = os.path.splitext(os.path.basename(path))[0]
+                stems = {
+                    'instruments': '{}{}_Instruments.wav'.format(output_dir, basename),
+                    'vocals': '{}{}_Vocals.wav'.format(output_dir, basename),
+                }
+                if cache.fetch(key, stems):
+                    print('reused cached stems {} for {}'.format(key[:12], os.path.basename(path)))
+                    outputs[path] = (stems['instruments'], stems['vocals'])
+                    continue
+                keys[path] = key
+            rates[path] = sr_
+            yield path, X_spec
+
+    for path, y_spec, v_spec in sp.separate_many(specs(), tta=tta):
+        print('writing {}...'.format(os.path.basename(path)))
+        basename = os.path.splitext(os.path.basename(path))[0]
+        outputs[path] = write_stems(
+            y_spec, v_spec, basename, output_dir, rates.pop(path), hop_length, output_image
+        )
+        if path in keys:
+            inst_path, vocal_path = outputs[path]
+            cache.put(keys.pop(path), {'instruments': inst_path, 'vocals': vocal_path}, source=basename)
+
+    return [outputs[path] for path in order]
+
+
+def read_blocks(path, blocksize):
+    with sf.SoundFile(path) as f:
+        for block in f.blocks(blocksize=blocksize, dtype='float32', always_2d=True):
+            block = block.T
+            if block.shape[0] == 1:
+                # mono to stereo
+                block = np.concatenate([block, block])
+            yield block[:2]
+
+
+def stream_spectrogram(path, n_fft, hop_length, blocksize):
+    stft = spec_utils.StreamingSTFT(n_fft, hop_length)
+    for block in read_blocks(path, blocksize):
+        yield stft.push(block)
+    yield stft.flush()
+
+
+def separate_file_stream(sp, input_path, n_fft, hop_length, output_dir='', blocksize=None):
+    info = sf.info(input_path)
+    basename = os.path.splitext(os.path.basename(input_path))[0]
+    if blocksize is None:
+        blocksize = (sp.cropsize - 2 * sp.offset) * hop_length
+
+    # the model input is normalized by the peak magnitude of the whole song,
+    # which needs one extra pass of stft over the source
+    print('scanning peak magnitude...', end=' ')
+    coef = np.float32(0)
+    for chunk in stream_spectrogram(input_path, n_fft, hop_length, blocksize):
+        if chunk.shape[2] > 0:
+            coef = max(coef, np.abs(chunk).max())
+    print('done')
+
+    print('validating output directory...', end=' ')
+    output_dir = prepare_output_dir(output_dir)
+    print('done')
+
+    inst_path = '{}{}_Instruments.wav'.format(output_dir, basename)
+    vocal_path = '{}{}_Vocals.wav'.format(output_dir, basename)
+    inst_istft = spec_utils.StreamingISTFT(n_fft, hop_length)
+    vocal_istft = spec_utils.StreamingISTFT(n_fft, hop_length)
+
+    roi_size = sp.cropsize - 2 * sp.offset
+    n_frame = info.frames // hop_length + 1
+    chunks = sp.separate_stream(stream_spectrogram(input_path, n_fft, hop_length, blocksize), coef)
+    with sf.SoundFile(inst_path, 'w', info.samplerate, 2) as f_inst, \
+            sf.SoundFile(vocal_path, 'w', info.samplerate, 2) as f_vocal:
+        for y_spec, v_spec in tqdm(chunks, total=int(np.ceil(n_frame / roi_size))):
+            f_inst.write(inst_istft.push(y_spec).T)
+            f_vocal.write(vocal_istft.push(v_spec).T)
+
+        f_inst.write(inst_istft.flush().T)
+        f_vocal.write(vocal_istft.flush().T)
+
+    return inst_path, vocal_path
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument('--gpu', '-g', type=int, default=-1)
+    p.add_argument('--pretrained_model', '-P', type=str, default=DEFAULT_MODEL_PATH)
+    p.add_argument('--input', '-i', required=True, help='audio file, directory, glob or manifest (.txt/.json)')
+    p.add_argument('--sr', '-r', type=int, default=44100)
+    p.add_argument('--n_fft', '-f', type=int, default=None, help='default: from the checkpoint')
+    p.add_argument('--hop_length', '-H', type=int, default=None, help='default: from the checkpoint')
+    p.add_argument('--batchsize', '-B', type=int, default=None, help='default: autotune.py profile, or 4')
+    p.add_argument('--cropsize', '-c', type=int, default=None, help='default: autotune.py profile, or 256')
+    p.add_argument('--output_image', '-I', action='store_true')
+    p.add_argument('--tta', '-t', action='store_true')
+    p.add_argument('--tta_shifts', type=int, default=2, help='number of patch offsets averaged by --tta')
+    p.add_argument('--tta_weights', type=float, nargs='+', default=None, help='one weight per tta shift')
+    p.add_argument('--cheap_tta', action='store_true', help='run the extra tta shifts only where the mask is uncertain')
+    p.add_argument('--tta_threshold', type=float, default=0.2)
+    p.add_argument('--output_dir', '-o', type=str, default="output", help="Output directory")
+    p.add_argument('--complex', '-X', action='store_true', default=None)
+    p.add_argument('--stream', action='store_true', help='separate block by block with bounded memory')
+    p.add_argument('--decode_workers', type=int, default=2)
+    p.add_argument('--cache_dir', type=str, default=None, help='reuse stems of previously separated audio')
+    p.add_argument('--cache_size', type=int, default=10240, help='cache size limit in MB')
+    p.add_argument('--stft_backend', type=str, choices=list(spec_utils.BACKENDS), default='librosa')
+    p.add_argument('--precision', type=str, choices=quantize.PRECISIONS, default='fp32')
+    p.add_argument('--calibration', type=str, default=None, help='songs for static int8 quantization of the convolutions')
+    p.add_argument('--calibration_patches', type=int, default=16, help='patches used per calibration song')
+    p.add_argument('--threads', type=int, default=None, help='intra-op threads (per replica with --replicas)')
+    p.add_argument('--replicas', type=int, default=1, help='model replicas on CPU, each pinned to its own cores')
+    p.add_argument('--cores', type=str, default=None, help='cores to use with --replicas, e.g. 0-31')
+    p.add_argument('--silence_threshold', type=float, default=None, help='skip patches this many dB (e.g. -80) below the loudest bin')
+    args = p.parse_args()
+
+    if args.stream and args.cache_dir is not None:
+        # the cache key hashes the whole decoded wave, which streaming never holds
+        p.error('--stream does not support --cache_dir')
+    if args.threads is not None and args.replicas <= 1:
+        replicas.set_threads(args.threads)
+
+    print('loading model...', end=' ')
+    device = get_device(args.gpu)
+    model = load_model(args.pretrained_model, args.n_fft, args.hop_length, args.complex, device)
+    args.n_fft, args.hop_length, args.complex = model.n_fft, model.hop_length, model.is_complex
+    #summary(model)
+    print('done')
+
+    calibration = resolve_inputs(args.calibration) if args.calibration is not None else []
+    model = apply_precision(
+        model, args.precision, device, calibration, args.sr, args.batchsize, args.cropsize,
+        args.calibration_patches
+    )
+
+    pool = None
+    if args.replicas > 1:
+        if device.type != 'cpu':
+            raise ValueError('--replicas is for CPU inference')
+        cores = replicas.parse_cores(args.cores) if args.cores is not None else None
+        pool = replicas.ReplicaPool(model, args.replicas, args.threads, cores, args.precision)
+        print('running {} replicas on cores {}'.format(args.replicas, pool.core_sets))
+
+    try:
+        spec_utils.set_backend(args.stft_backend, device)
+
+        sp = Separator(
+            model=model,
+            device=device,
+            batchsize=args.batchsize,
+            cropsize=args.cropsize,
+            tta_shifts=args.tta_shifts,
+            tta_weights=args.tta_weights,
+            cheap_tta=args.cheap_tta,
+            tta_threshold=args.tta_threshold,
+            precision=args.precision,
+            pool=pool,
+            silence_threshold=args.silence_threshold
+        )
+
+        cache = model_hash = None
+        if args.cache_dir is not None:
+            cache = result_cache.ResultCache(args.cache_dir, args.cache_size * 1024 ** 2)
+            model_hash = result_cache.checkpoint_hash(args.pretrained_model)
+            if args.precision != 'fp32':
+                model_hash += ':' + args.precision
+            if args.precision == 'int8' and len(calibration) > 0:
+                # the quantized convolutions depend on the calibration songs
+                model_hash += ':static:{}:{}'.format(
+                    args.calibration_patches, result_cache.files_hash(calibration)[:16]
+                )
+
+        inputs = resolve_inputs(args.input)
+        if len(inputs) == 0:
+            raise FileNotFoundError('no input found for {}'.format(args.input))
+        elif len(inputs) > 1:
+            separate_files(
+                sp, inputs, args.sr, args.n_fft, args.hop_length,
+                tta=args.tta,
+                output_dir=args.output_dir,
+                output_image=args.output_image,
+                decode_workers=args.decode_workers,
+                cache=cache,
+                model_hash=model_hash
+            )
+            return
+
+        input_path = inputs[0]
+        if args.stream and (args.tta or args.output_image):
+            print('--stream does not support --tta and --output_image, falling back to in-memory separation')
+            args.stream = False
+        if args.stream and sf.info(input_path).samplerate != args.sr:
+            print('--stream needs a source sampled at {} Hz, falling back to in-memory separation'.format(args.sr))
+            args.stream = False
+
+        if args.stream:
+            separate_file_stream(
+                sp, input_path, args.n_fft, args.hop_length,
+                output_dir=args.output_dir
+            )
+        else:
+            separate_file(
+                sp, input_path, args.sr, args.n_fft, args.hop_length,
+                tta=args.tta,
+                output_dir=args.output_dir,
+                output_image=args.output_image,
+                cache=cache,
+                model_hash=model_hash
+            )
+    finally:
+        if pool is not None:
+            pool.close()
+
 
 if __name__ == '__main__':
     main()
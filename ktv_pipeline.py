@@ -0,0 +1,343 @@
+import os
+import queue
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+import librosa
+import numpy as np
+import soundfile as sf
+
+import generator_subtitle
+import inference
+import ktv_video
+from lib import decode
+from lib import nets
+from lib import spec_utils
+from lib.remote import SeparationClient
+from lib.result_cache import DEFAULT_CACHE_DIR, ResultCache, cache_key, checkpoint_hash
+from yt_downloader import MusicDownloader
+
+WHISPER_SR = 16000
+
+
+# 一首歌在各階段之間傳遞的資料
+class Job(object):
+    def __init__(self, job_id, url, output_dir, bg_image=None):
+        self.id = job_id
+        self.url = url
+        self.output_dir = output_dir
+        self.bg_image = bg_image
+        self.input_path = None
+        self.basename = None
+        self.cache_key = None
+        self.instruments_path = None
+        self.vocals_path = None
+        self.vocals = None  # 16 kHz 單聲道 float32，直接交給 Whisper
+        self.subtitle_path = None
+        self.video_path = None
+        self.timings = {}
+        self.progress = {}  # 各階段目前的百分比
+        self.error = None
+
+
+# 進度事件：status 為 queued / start / progress / done / error / finished，
+# percent 是該階段自己的 0~100
+class Event(object):
+    def __init__(self, job, stage, status, percent=0, message=""):
+        self.job = job
+        self.stage = stage
+        self.status = status
+        self.percent = percent
+        self.message = message
+
+
+# === 行程內的 KTV 流水線：下載 → 人聲分離 → 字幕 → 合成影片 ===
+# 每個階段有自己的執行緒，階段之間用 queue 串接，所以第 k 首歌在分離時，
+# 第 k+1 首歌已經在下載。每個階段屬於一個資源池，池的大小決定同時能跑幾個工作：
+# 下載可以同時好幾個，分離和字幕共用 model 池，預設一次只跑一個模型工作。
+class KTVPipeline(object):
+    STAGES = ["download", "separate", "transcribe", "render"]
+    STAGE_POOLS = {"download": "network", "separate": "model", "transcribe": "model", "render": "cpu"}
+    DEFAULT_POOLS = {"network": 3, "model": 1, "cpu": 1}
+
+    def __init__(
+            self, output_dir="output", gpu=-1, pretrained_model=inference.DEFAULT_MODEL_PATH,
+            server=None, cache_dir=DEFAULT_CACHE_DIR, bg_image=None, whisper_model="medium",
+            whisper_threads=0, vad_filter=True, write_vocals=True, pools=None, on_event=None):
+        self.output_dir = output_dir
+        self.gpu = gpu
+        self.pretrained_model = pretrained_model
+        self.server = server
+        self.cache = ResultCache(cache_dir) if cache_dir is not None else None
+        self.bg_image = bg_image
+        self.whisper_model = whisper_model
+        self.whisper_threads = whisper_threads
+        self.vad_filter = vad_filter
+        self.write_vocals = write_vocals  # False 時只在記憶體裡把人聲交給 Whisper，不輸出原取樣率的人聲檔
+        self.pool_sizes = dict(self.DEFAULT_POOLS, **(pools or {}))
+        self.pools = {name: threading.Semaphore(size) for name, size in self.pool_sizes.items()}
+        self.on_event = on_event
+
+        # 模型在各自的階段執行緒第一次用到時才載入，和第一首歌的下載重疊
+        self.separator = None
+        self.separator_lock = threading.Lock()
+        self.settings = None
+        self.transcriber = None
+        self.transcriber_lock = threading.Lock()
+        self.downloader = MusicDownloader()
+
+        self.lock = threading.Lock()
+        self.queues = None
+        self.jobs = []
+        self.job_count = 0
+        self.done = threading.Event()
+
+    def log(self, message):
+        print(message)
+        sys.stdout.flush()
+
+    def emit(self, job, stage, status, percent=0, message=""):
+        percent = int(percent)
+        if status == "progress":
+            # 下載與分離的回報很頻繁，百分比有變化才送出
+            if job.progress.get(stage) == percent:
+                return
+        job.progress[stage] = percent
+
+        if self.on_event is not None:
+            self.on_event(Event(job, stage, status, percent, message))
+
+    def download(self, job):
+        self.log("🎵 偵測到 YouTube 連結，自動下載音樂中...")
+        job.input_path = self.downloader.download_music(
+            job.url, progress_hook=lambda fraction: self.emit(job, "download", "progress", 100 * fraction)
+        )
+        job.basename = os.path.splitext(os.path.basename(job.input_path))[0]
+
+    def load_separator(self):
+        if self.separator is None:
+            device = inference.get_device(self.gpu)
+            # STFT 設定來自 checkpoint，batchsize / cropsize 來自 autotune 設定檔
+            model = inference.load_model(self.pretrained_model, device=device)
+            self.separator = inference.Separator(model=model, device=device)
+
+        return self.separator
+
+    # 分離實際使用的設定。本機分離時取自 Separator；用 server 時 STFT 設定讀自
+    # checkpoint，batchsize / cropsize 向 server 查詢。快取鍵與送給 server 的參數都用這一份
+    def separation_settings(self):
+        with self.separator_lock:
+            if self.settings is None:
+                if self.server is not None:
+                    arch = nets.read_arch(self.pretrained_model)
+                    settings = {"n_fft": arch["n_fft"], "hop_length": arch["hop_length"], "is_complex": arch["is_complex"]}
+                    with SeparationClient(
+                        self.server, pretrained_model=self.pretrained_model, gpu=self.gpu, **settings
+                    ) as client:
+                        settings.update(client.settings())
+                else:
+                    sp = self.load_separator()
+                    settings = {
+                        "n_fft": sp.model.n_fft,
+                        "hop_length": sp.model.hop_length,
+                        "is_complex": sp.is_complex,
+                        "batchsize": sp.batchsize,
+                        "cropsize": sp.cropsize,
+                    }
+                self.settings = settings
+
+        return self.settings
+
+    def separate(self, job):
+        self.log("\n分離人聲與伴奏")
+        os.makedirs(job.output_dir, exist_ok=True)
+        job.instruments_path = os.path.join(job.output_dir, f"{job.basename}_Instruments.wav")
+        job.vocals_path = os.path.join(job.output_dir, f"{job.basename}_Vocals.wav")
+        stems = {"instruments": job.instruments_path}
+        if self.write_vocals:
+            stems["vocals"] = job.vocals_path
+
+        X, sr = decode.load_wave(job.input_path, 44100)
+        settings = self.separation_settings()
+        n_fft, hop_length = settings["n_fft"], settings["hop_length"]
+        if self.cache is not None:
+            job.cache_key = cache_key(
+                X, sr, checkpoint_hash(self.pretrained_model), n_fft, hop_length, settings["cropsize"],
+                False, settings["is_complex"]
+            )
+            # 給 Whisper 的 16 kHz 人聲直接從快取讀，不複製到輸出資料夾
+            files = self.cache.get(job.cache_key)
+            if files is not None and all(name in files for name in list(stems) + ["vocals_16k"]):
+                self.log(f"♻️ 使用快取的分離結果 {job.cache_key[:12]}")
+                for name, path in stems.items():
+                    shutil.copyfile(files[name], path)
+                job.vocals, _ = sf.read(files["vocals_16k"], dtype="float32")
+                if not self.write_vocals:
+                    job.vocals_path = None
+                return
+
+        if self.server is not None:
+            # 交給常駐的 separation_server.py，它一定會寫出人聲檔。
+            # 模型與設定都明確指定，和快取鍵一致
+            with SeparationClient(self.server, pretrained_model=self.pretrained_model, gpu=self.gpu, **settings) as client:
+                client.separate_file(job.input_path, output_dir=job.output_dir)
+            v_wave, _ = decode.load_wave(job.vocals_path, sr)
+            job.vocals = librosa.resample(
+                v_wave.mean(axis=0), orig_sr=sr, target_sr=WHISPER_SR
+            ).astype(np.float32)
+            if not self.write_vocals:
+                os.remove(job.vocals_path)
+        else:
+            X_spec = spec_utils.wave_to_spectrogram(inference.to_stereo(X), hop_length, n_fft)
+            # 同一個 Separator 一次只給一首歌用，進度回報才不會混在一起
+            with self.separator_lock:
+                sp = self.load_separator()
+                sp.progress = lambda done, total: self.emit(
+                    job, "separate", "progress", 100 * done / total if total else 0
+                )
+                try:
+                    y_spec, v_spec = sp.separate(X_spec)
+                finally:
+                    sp.progress = None
+
+            sf.write(job.instruments_path, spec_utils.spectrogram_to_wave(y_spec, hop_length=hop_length).T, sr)
+            if self.write_vocals:
+                sf.write(job.vocals_path, spec_utils.spectrogram_to_wave(v_spec, hop_length=hop_length).T, sr)
+            # 人聲在頻譜上先混成單聲道，只做一次 iSTFT，再直接降到 16 kHz 給 Whisper
+            job.vocals = spec_utils.spectrogram_to_mono_wave(v_spec, hop_length, sr, WHISPER_SR)
+
+        if not self.write_vocals:
+            job.vocals_path = None
+
+        if self.cache is not None:
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                vocals_16k = os.path.join(tmp_dir, "vocals_16k.wav")
+                sf.write(vocals_16k, job.vocals, WHISPER_SR, subtype="FLOAT")
+                self.cache.put(job.cache_key, dict(stems, vocals_16k=vocals_16k), source=job.basename)
+
+    def transcribe(self, job):
+        self.log("\n生成字幕檔")
+        job.subtitle_path = os.path.join(job.output_dir, f"{job.basename}_subtitle.srt")
+        # 不同的 Whisper 模型與 VAD 設定各自快取
+        name = f"subtitle-{self.whisper_model}" + ("-vad" if self.vad_filter else "")
+        subtitle = {name: job.subtitle_path}
+
+        if self.cache is not None and self.cache.fetch(job.cache_key, subtitle):
+            self.log(f"♻️ 使用快取的字幕 {job.cache_key[:12]}")
+        else:
+            with self.transcriber_lock:
+                if self.transcriber is None:
+                    self.transcriber = generator_subtitle.Transcriber(
+                        self.whisper_model, cpu_threads=self.whisper_threads, vad_filter=self.vad_filter
+                    )
+                self.transcriber.transcribe(
+                    job.vocals, job.subtitle_path,
+                    progress=lambda fraction: self.emit(job, "transcribe", "progress", 100 * fraction)
+                )
+            if self.cache is not None:
+                self.cache.put(job.cache_key, subtitle)
+
+        job.vocals = None
+
+    def render(self, job):
+        self.log("\n合成 KTV 影片")
+        job.video_path = os.path.join(job.output_dir, f"{job.basename}_video.mp4")
+        ktv_video.render_video(
+            job.instruments_path, job.subtitle_path, job.video_path, job.bg_image or self.bg_image
+        )
+
+    def _worker(self, stage, inbox, outbox, remaining):
+        fn = getattr(self, stage)
+        pool = self.pools[self.STAGE_POOLS[stage]]
+        while True:
+            job = inbox.get()
+            if job is None:
+                # 放回去讓同階段的其他執行緒也收到結束訊號，最後一個再往下傳
+                inbox.put(None)
+                with self.lock:
+                    remaining[stage] -= 1
+                    last = remaining[stage] == 0
+                if last:
+                    outbox.put(None)
+                break
+
+            if job.error is None:
+                with pool:
+                    self.emit(job, stage, "start")
+                    start = time.perf_counter()
+                    try:
+                        fn(job)
+                    except Exception as e:
+                        job.error = f"{stage}: {e}"
+                        self.log(f"❌ {job.url} 在 {stage} 階段失敗：{e}")
+                        self.emit(job, stage, "error", job.progress.get(stage, 0), str(e))
+                    else:
+                        self.emit(job, stage, "done", 100)
+                    job.timings[stage] = time.perf_counter() - start
+
+            outbox.put(job)
+
+    def _collect(self):
+        while True:
+            job = self.queues[-1].get()
+            if job is None:
+                break
+            with self.lock:
+                self.jobs.append(job)
+            if job.error is None:
+                self.log(f"\n✅ 全部完成！已產出影片：{job.video_path}")
+                self.emit(job, None, "finished", 100, job.video_path)
+            else:
+                self.emit(job, None, "error", 0, job.error)
+
+        self.done.set()
+
+    def start(self):
+        # 第一個 queue 不限容量，submit() 永遠不會卡住呼叫端（例如 GUI）
+        self.queues = [queue.Queue()] + [queue.Queue(maxsize=1) for _ in self.STAGES]
+        workers = {stage: self.pool_sizes[self.STAGE_POOLS[stage]] for stage in self.STAGES}
+        remaining = dict(workers)
+        for i, stage in enumerate(self.STAGES):
+            for _ in range(workers[stage]):
+                threading.Thread(
+                    target=self._worker, args=(stage, self.queues[i], self.queues[i + 1], remaining),
+                    daemon=True
+                ).start()
+        threading.Thread(target=self._collect, daemon=True).start()
+
+    def submit(self, url, output_dir=None, bg_image=None):
+        with self.lock:
+            self.job_count += 1
+            job = Job(self.job_count, url, output_dir or self.output_dir, bg_image)
+        self.emit(job, None, "queued")
+        self.queues[0].put(job)
+        return job
+
+    def close(self):
+        self.queues[0].put(None)
+
+    def run(self, urls):
+        start = time.perf_counter()
+        self.start()
+        for url in urls:
+            self.submit(url)
+        self.close()
+        self.done.wait()
+
+        jobs = sorted(self.jobs, key=lambda job: job.id)
+        self.report(jobs, time.perf_counter() - start)
+        return jobs
+
+    def report(self, jobs, wall_time):
+        self.log("\n⏱️ 各階段耗時（秒）")
+        self.log("  ".join([f"{'song':<30}"] + [f"{stage:>10}" for stage in self.STAGES]))
+        for job in jobs:
+            name = (job.basename or job.url)[:30]
+            self.log("  ".join(
+                [f"{name:<30}"] + [f"{job.timings.get(stage, 0):>10.1f}" for stage in self.STAGES]
+            ))
+        serial = sum(sum(job.timings.values()) for job in jobs)
+        self.log(f"總計 {wall_time:.1f} 秒（逐首執行需 {serial:.1f} 秒）")
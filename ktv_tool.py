@@ -1,72 +1,47 @@
 import argparse
-import subprocess
-import os
 import sys
-import glob
-from yt_downloader import MusicDownloader
+from ktv_pipeline import KTVPipeline
+from lib.result_cache import DEFAULT_CACHE_DIR
 
-# === 主流程：從 YouTube 下載並執行 inference、subtitle、ktv_video ===
-def run_pipeline(youtube_url):
-#def run_pipeline(youtube_url, gpu_id=-1): #use gpu mode
-    print("🎵 偵測到 YouTube 連結，自動下載音樂中...")
-    sys.stdout.flush()
+# === 主流程：從 YouTube 下載並在同一個行程內執行人聲分離、字幕、合成影片 ===
+def run_pipeline(
+        youtube_urls, server=None, cache_dir=DEFAULT_CACHE_DIR, gpu_id=-1, download_workers=3,
+        whisper_model="medium", whisper_threads=0, vad_filter=True, write_vocals=True):
+    if isinstance(youtube_urls, str):
+        youtube_urls = [youtube_urls]
 
-    # 下載音樂
-    downloader = MusicDownloader()
-    input_path = downloader.download_music(youtube_url)
-    downloader.close_driver()
-
-    basename = os.path.splitext(os.path.basename(input_path))[0]
-
-    os.makedirs("output", exist_ok=True)
-
-    # Step 1️⃣ 執行 inference.py 進行人聲分離
-    print("\n分離人聲與伴奏"); sys.stdout.flush()
-    subprocess.run([
-        "python", "inference.py",
-        "--input", input_path
-    ], check=True)
-    '''
-    #gpu mode
-    subprocess.run([
-    "python", "inference.py",
-    "--input", input_path,
-    "--gpu", str(gpu_id)   # ✅ 加上這個
-    ], check=True)
-    '''
-
-    # Step 2️⃣ 執行 generator_subtitle.py 產生字幕
-    print("\n生成字幕檔"); sys.stdout.flush()
-    subprocess.run([
-        "python", "generator_subtitle.py",
-        "--input", f"output/{basename}_Vocals.wav",
-        "--output", f"output/{basename}_subtitle.srt"
-    ], check=True)
-
-    # Step 3️⃣ 執行 ktv_video.py 合成 KTV 影片
-    print("\n合成 KTV 影片"); sys.stdout.flush()
-    subprocess.run([
-        "python", "ktv_video.py",
-        "--input_audio", f"output/{basename}_Instruments.wav",
-        "--input_subtitle", f"output/{basename}_subtitle.srt",
-        "--output_video", f"output/{basename}_video.mp4"
-    ], check=True)
-
-    print(f"\n✅ 全部完成！已產出影片：output/{basename}_video.mp4"); sys.stdout.flush()
+    pipeline = KTVPipeline(
+        gpu=gpu_id, server=server, cache_dir=cache_dir, pools={"network": download_workers},
+        whisper_model=whisper_model, whisper_threads=whisper_threads, vad_filter=vad_filter,
+        write_vocals=write_vocals
+    )
+    return pipeline.run(youtube_urls)
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
-    parser.add_argument("--input", "-i", required=True, help="YouTube 音樂網址")
-    args = parser.parse_args()
-
-    run_pipeline(args.input)
-    '''
-    gpu mode
-    parser = argparse.ArgumentParser()
-    parser.add_argument("--input", "-i", required=True, help="YouTube 音樂網址")
+    parser.add_argument("--input", "-i", required=True, nargs="+", help="YouTube 音樂網址（可一次給多個）")
+    parser.add_argument("--server", "-s", default=None, help="separation_server.py 的位址 (host:port)")
+    parser.add_argument("--cache_dir", default=DEFAULT_CACHE_DIR, help="分離結果與字幕的快取資料夾")
+    parser.add_argument("--no_cache", action="store_true", help="不使用快取")
     parser.add_argument("--gpu", type=int, default=-1, help="GPU 編號，-1 表示使用 CPU")
+    parser.add_argument("--download_workers", type=int, default=3, help="同時下載的數量")
+    parser.add_argument("--whisper_model", default="medium", help="Whisper 模型大小")
+    parser.add_argument("--whisper_threads", type=int, default=0, help="Whisper 使用的 CPU 執行緒數，0 為自動")
+    parser.add_argument("--no_vad", action="store_true", help="字幕不使用 VAD 跳過靜音段落")
+    parser.add_argument("--no_vocals_wav", action="store_true", help="不輸出人聲檔，人聲只在記憶體中交給 Whisper")
     args = parser.parse_args()
 
-    run_pipeline(args.input, gpu_id=args.gpu)
-    '''
\ No newline at end of file
+    jobs = run_pipeline(
+        args.input,
+        server=args.server,
+        cache_dir=None if args.no_cache else args.cache_dir,
+        gpu_id=args.gpu,
+        download_workers=args.download_workers,
+        whisper_model=args.whisper_model,
+        whisper_threads=args.whisper_threads,
+        vad_filter=not args.no_vad,
+        write_vocals=not args.no_vocals_wav
+    )
+    if any(job.error is not None for job in jobs):
+        sys.exit(1)
@@ -0,0 +1,135 @@
+import json
+import os
+import platform
+import time
+
+import numpy as np
+import torch
+
+from lib import result_cache
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+DEFAULT_PROFILE_PATH = os.path.join(os.path.expanduser('~'), '.vocal-remover', 'autotune.json')
+DEFAULT_BATCHSIZE = 4
+DEFAULT_CROPSIZE = 256
+CROPSIZES = [256, 384, 512, 768, 1024]
+BATCHSIZES = [1, 2, 4, 8, 16]
+
+
+def device_name(device=None):
+    if device is not None and device.type == 'cuda':
+        return 'cuda:{}'.format(torch.cuda.get_device_name(device))
+
+    cpu = platform.processor() or platform.machine()
+    if os.path.exists('/proc/cpuinfo'):
+        with open('/proc/cpuinfo') as f:
+            for line in f:
+                if line.startswith('model name'):
+                    cpu = line.split(':', 1)[1].strip()
+                    break
+
+    # the best setting depends on how many threads the model gets
+    return 'cpu:{}:{}threads'.format(cpu, torch.get_num_threads())
+
+
+def profile_key(device, model_hash, n_fft):
+    return '{}|{}|{}'.format(device_name(device), model_hash, n_fft)
+
+
+def load_profile(path=DEFAULT_PROFILE_PATH):
+    if not os.path.exists(path):
+        return {}
+
+    with open(path, 'r', encoding='utf8') as f:
+        return json.load(f)
+
+
+def save_profile(key, entry, path=DEFAULT_PROFILE_PATH):
+    profile = load_profile(path)
+    profile[key] = entry
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf8') as f:
+        json.dump(profile, f, indent=1)
+    os.replace(tmp_path, path)
+
+
+def lookup(model, device=None, path=DEFAULT_PROFILE_PATH):
+    # the tuned {'batchsize', 'cropsize', ...} of this model on this device, or None
+    checkpoint = getattr(model, 'checkpoint_path', None)
+    if checkpoint is None or not os.path.exists(path):
+        return None
+
+    key = profile_key(device, result_cache.checkpoint_hash(checkpoint), model.n_fft)
+
+    return load_profile(path).get(key)
+
+
+def peak_memory(device):
+    if device is not None and device.type == 'cuda':
+        return torch.cuda.max_memory_allocated(device)
+    if resource is not None:
+        # ru_maxrss is in KB on Linux; it only grows, so combinations are run from small to large
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+    return 0
+
+
+def benchmark(model, device=None, cropsizes=CROPSIZES, batchsizes=BATCHSIZES, n_batches=4, max_memory=None):
+    # throughput in useful (non-overlapping) frames per second and peak memory
+    # for every cropsize x batchsize combination
+    model.eval()
+    combinations = sorted(
+        [(c, b) for c in cropsizes for b in batchsizes if c > 2 * model.offset],
+        key=lambda cb: cb[0] * cb[1]
+    )
+    dtype = np.complex64 if model.is_complex else np.float32
+
+    results = []
+    for cropsize, batchsize in combinations:
+        shape = (batchsize, 2, model.n_fft // 2 + 1, cropsize)
+        X_batch = torch.from_numpy(np.random.RandomState(0).rand(*shape).astype(dtype))
+        if device is not None:
+            X_batch = X_batch.to(device)
+            if device.type == 'cuda':
+                torch.cuda.empty_cache()
+                torch.cuda.reset_peak_memory_stats(device)
+
+        try:
+            with torch.no_grad():
+                model.predict_mask(X_batch)  # warm up
+                start = time.perf_counter()
+                for _ in range(n_batches):
+                    model.predict_mask(X_batch)
+                if device is not None and device.type == 'cuda':
+                    torch.cuda.synchronize(device)
+                elapsed = time.perf_counter() - start
+        except RuntimeError as e:
+            # out of memory, larger combinations will not fit either
+            print('cropsize {} batchsize {}: {}'.format(cropsize, batchsize, str(e).splitlines()[0]))
+            break
+
+        peak = peak_memory(device)
+        roi_size = cropsize - 2 * model.offset
+        fps = n_batches * batchsize * roi_size / elapsed
+        results.append({
+            'cropsize': cropsize,
+            'batchsize': batchsize,
+            'frames_per_sec': fps,
+            'peak_memory': peak,
+        })
+        print('cropsize {:>4} batchsize {:>2}: {:>8.1f} frames/sec, peak memory {:.0f} MB'.format(
+            cropsize, batchsize, fps, peak / 1024 ** 2
+        ))
+
+        if max_memory is not None and peak > max_memory:
+            results.pop()
+            break
+
+    return results
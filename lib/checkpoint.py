@@ -0,0 +1,54 @@
+import hashlib
+
+import torch
+
+
+# 1: plain state dict, 2: weights with architecture, STFT settings and hash
+FORMAT_VERSION = 2
+
+
+def weights_hash(state_dict):
+    h = hashlib.sha256()
+    for key in sorted(state_dict):
+        tensor = state_dict[key].detach().cpu().contiguous()
+        h.update('{}:{}:{}'.format(key, tensor.dtype, tuple(tensor.shape)).encode('utf8'))
+        h.update(tensor.reshape(-1).view(torch.uint8).numpy().tobytes())
+
+    return h.hexdigest()
+
+
+def save(path, arch, state_dict, sr=None):
+    torch.save({
+        'format': FORMAT_VERSION,
+        'arch': arch,
+        'sr': sr,
+        'hash': weights_hash(state_dict),
+        'state_dict': state_dict,
+    }, path)
+
+
+def load(path, verify=False):
+    # Returns (header, state_dict). The tensors are memory-mapped from the
+    # file: pages are only read when a weight is used, and processes loading
+    # the same checkpoint share them through the page cache.
+    try:
+        checkpoint = torch.load(path, map_location='cpu', mmap=True, weights_only=True)
+    except RuntimeError:
+        # files in the legacy (non-zip) serialization cannot be memory-mapped
+        checkpoint = torch.load(path, map_location='cpu', weights_only=True)
+
+    if 'state_dict' not in checkpoint:
+        return {'format': 1}, checkpoint
+
+    state_dict = checkpoint.pop('state_dict')
+    if verify and checkpoint.get('hash') is not None and weights_hash(state_dict) != checkpoint['hash']:
+        raise ValueError('{} is corrupted: the weights do not match their hash'.format(path))
+
+    return checkpoint, state_dict
+
+
+def read_hash(path):
+    # the hash stored in the checkpoint (the weights are not read), or None
+    header, _ = load(path)
+
+    return header.get('hash')
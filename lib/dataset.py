@@ -1,3 +1,4 @@
+from concurrent.futures import ThreadPoolExecutor
 import os
 import random
 
@@ -12,12 +13,42 @@ except ModuleNotFoundError:
     import spec_utils
 
 
+def magnitude(x):
+    # torch's complex abs is several times slower than numpy's on CPU
+    if x.device.type == 'cpu' and x.is_complex():
+        return torch.from_numpy(np.abs(x.numpy()))
+
+    return torch.abs(x)
+
+
+def scale(x, s):
+    # x * s for a real s; on the real view, since complex by real products are slow on CPU
+    if x.is_complex():
+        return torch.view_as_complex(torch.view_as_real(x) * s.unsqueeze(-1))
+
+    return x * s
+
+
+def mixup_partners(idx, batchsize):
+    # a random other sample of the batch for each of idx; mixing a sample
+    # with itself would leave it unchanged
+    offset = torch.randint(1, batchsize, idx.shape, device=idx.device)
+
+    return (idx + offset) % batchsize
+
+
 class VocalRemoverTrainingSet(torch.utils.data.Dataset):
 
     def __init__(
             self, training_set, cropsize, reduction_rate, reduction_weight,
-            mixup_rate, mixup_alpha, is_complex=False):
+            mixup_rate, mixup_alpha, is_complex=False, shards=None, batch_aug=False):
+        # training_set holds [X_path, y_path, v_path, coef] entries, or
+        # [song index, coef] entries of the shard store `shards`. With
+        # batch_aug, samples are plain (X, y, v) crops and augment_batch
+        # augments whole batches on the training device.
         self.training_set = training_set
+        self.shards = shards
+        self.batch_aug = batch_aug
         self.cropsize = cropsize
         self.reduction_rate = reduction_rate
         self.reduction_weight = reduction_weight
@@ -59,15 +90,19 @@ class VocalRemoverTrainingSet(torch.utils.data.Dataset):
 
         return y_mag * np.exp(1.j * np.angle(y))
 
-    def do_crop(self, X_path, y_path, v_path):
-        shape = self.read_npy_shape(X_path)
-        start_row = np.random.randint(0, shape[0] - self.cropsize)
-
-        X_crop = self.read_npy_chunk(X_path, start_row).transpose(1, 2, 0)
-        y_crop = self.read_npy_chunk(y_path, start_row).transpose(1, 2, 0)
-        v_crop = self.read_npy_chunk(v_path, start_row).transpose(1, 2, 0)
+    def do_crop(self, entry):
+        if self.shards is not None:
+            idx = entry[0]
+            start_row = np.random.randint(0, self.shards.n_frames(idx) - self.cropsize)
+            crops = self.shards.crop(idx, start_row, self.cropsize)
+        else:
+            X_path, y_path, v_path = entry[:3]
+            shape = self.read_npy_shape(X_path)
+            start_row = np.random.randint(0, shape[0] - self.cropsize)
+            crops = [self.read_npy_chunk(path, start_row) for path in [X_path, y_path, v_path]]
 
-        return X_crop, y_crop, v_crop
+        # compact caches are expanded to complex64 (or float32 magnitude) per crop
+        return [spec_utils.decode_cache(crop).transpose(1, 2, 0) for crop in crops]
 
     def do_aug(self, X, y, v):
         if np.random.uniform() < self.reduction_rate:
@@ -93,12 +128,13 @@ class VocalRemoverTrainingSet(torch.utils.data.Dataset):
 
     def do_mixup(self, X, y, v):
         idx = np.random.randint(0, len(self))
-        X_path, y_path, v_path, coef = self.training_set[idx]
+        entry = self.training_set[idx]
+        coef = entry[-1]
 
-        X_i, y_i, v_i = self.do_crop(X_path, y_path, v_path)
-        X_i /= coef
-        y_i /= coef
-        v_i /= coef
+        X_i, y_i, v_i = self.do_crop(entry)
+        X_i = X_i / coef
+        y_i = y_i / coef
+        v_i = v_i / coef
 
         X_i, y_i, v_i = self.do_aug(X_i, y_i, v_i)
 
@@ -110,12 +146,17 @@ class VocalRemoverTrainingSet(torch.utils.data.Dataset):
         return X, y, v
 
     def __getitem__(self, idx):
-        X_path, y_path, v_path, coef = self.training_set[idx]
+        entry = self.training_set[idx]
+        coef = entry[-1]
 
-        X, y, v = self.do_crop(X_path, y_path, v_path)
-        X /= coef
-        y /= coef
-        v /= coef
+        # the crops may be read-only views of the shard store
+        X, y, v = self.do_crop(entry)
+        X = X / coef
+        y = y / coef
+        v = v / coef
+
+        if self.batch_aug:
+            return X, y, v
 
         X, y, v = self.do_aug(X, y, v)
 
@@ -130,6 +171,55 @@ class VocalRemoverTrainingSet(torch.utils.data.Dataset):
             y_mag = np.abs(np.concatenate([y, v]))
             return X_mag, y_mag
 
+    def augment_batch(self, X, y, v):
+        # do_aug and do_mixup for a collated batch, with per-sample random
+        # parameters; the mixup partner is another sample of the same batch.
+        # Only the selected samples are touched, in place.
+        B = X.size()[0]
+        device = X.device
+
+        def pick(rate):
+            return torch.nonzero(torch.rand(B, device=device) < rate).view(-1)
+
+        idx = pick(self.reduction_rate)
+        if len(idx) > 0:
+            X_mag = magnitude(X[idx])
+            y_mag = magnitude(y[idx])
+            v_mag = X_mag - y_mag
+            v_mag *= v_mag > y_mag
+            weight = torch.as_tensor(self.reduction_weight, device=device).view(1, 1, -1, 1)
+            # scaling by the reduced magnitude keeps the phase of y without
+            # going through angle and exp; where |y| is 0 the result is 0 anyway
+            gain = torch.clamp(y_mag - v_mag * weight, min=0) / torch.clamp(y_mag, min=1e-12)
+            y[idx] = scale(y[idx], gain)
+
+        idx = pick(0.5)
+        if len(idx) > 0:
+            # swap channel
+            X[idx] = X[idx].flip(1)
+            y[idx] = y[idx].flip(1)
+            v[idx] = v[idx].flip(1)
+
+        idx = pick(0.01)
+        if len(idx) > 0:
+            # inst
+            X[idx] = y[idx]
+            v[idx] = 0
+
+        idx = pick(self.mixup_rate) if B > 1 else []
+        if len(idx) > 0:
+            partner = mixup_partners(idx, B)
+            lam = torch.distributions.Beta(self.mixup_alpha, self.mixup_alpha).sample((len(idx),))
+            lam = lam.to(device).view(-1, 1, 1, 1)
+            X[idx], y[idx], v[idx] = [
+                scale(a[idx], lam) + scale(a[partner], 1 - lam) for a in [X, y, v]
+            ]
+
+        if self.is_complex:
+            return X, torch.cat([y, v], dim=1)
+
+        return magnitude(X), magnitude(torch.cat([y, v], dim=1))
+
 
 class VocalRemoverValidationSet(torch.utils.data.Dataset):
 
@@ -250,14 +340,28 @@ def make_padding(width, cropsize, offset):
     return left, right, roi_size
 
 
-def make_training_set(filelist, sr, hop_length, n_fft):
-    ret = []
-    for X_path, y_path, v_path in tqdm(filelist):
-        X, y, v, X_cache_path, y_cache_path, v_cache_path = spec_utils.cache_or_load(
-            X_path, y_path, v_path, sr, hop_length, n_fft
-        )
-        coef = np.max([np.abs(X).max(), np.abs(y).max(), np.abs(v).max()])
-        ret.append([X_cache_path, y_cache_path, v_cache_path, coef])
+def read_training_entry(X_path, y_path, v_path, sr, hop_length, n_fft, is_complex=False):
+    # [X_cache_path, y_cache_path, v_cache_path, coef] from the small sidecars of the caches
+    cache_paths = spec_utils.cache_paths(X_path, y_path, v_path, sr, hop_length, n_fft)
+    metas = [spec_utils.read_cache_meta(path) for path in cache_paths]
+
+    if not metas[0]['shape'] == metas[1]['shape'] == metas[2]['shape']:
+        raise ValueError('{} and its stems differ in length'.format(cache_paths[0]))
+    if is_complex and metas[0]['format'] == 'mag16':
+        raise ValueError('{} is a magnitude-only cache, complex training needs complex64 or complex32'.format(cache_paths[0]))
+
+    coef = np.float32(max(meta['max'] for meta in metas))
+
+    return cache_paths + [coef]
+
+
+def make_training_set(filelist, sr, hop_length, n_fft, is_complex=False, workers=8):
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [
+            pool.submit(read_training_entry, X_path, y_path, v_path, sr, hop_length, n_fft, is_complex)
+            for X_path, y_path, v_path in filelist
+        ]
+        ret = [future.result() for future in tqdm(futures)]
 
     return ret
 
@@ -0,0 +1,58 @@
+import collections
+import concurrent.futures
+
+import librosa
+import numpy as np
+import soundfile as sf
+
+
+def load_wave(path, sr, res_type='kaiser_fast'):
+    # Same output as librosa.load(path, sr=sr, mono=False, dtype=np.float32),
+    # but files already at `sr` are read directly without going through the
+    # resampler.
+    try:
+        native_sr = sf.info(path).samplerate
+    except RuntimeError:
+        # format not supported by soundfile, e.g. m4a
+        native_sr = None
+
+    if native_sr == sr:
+        wave, _ = sf.read(path, dtype='float32')
+        return wave.T, sr
+
+    return librosa.load(path, sr=sr, mono=False, dtype=np.float32, res_type=res_type)
+
+
+def _decode(path, sr, res_type, transform):
+    wave, sr = load_wave(path, sr, res_type)
+    if transform is not None:
+        wave = transform(wave)
+
+    return path, wave, sr
+
+
+def iter_decoded(paths, sr, res_type='kaiser_fast', workers=2, prefetch=2, processes=False, transform=None):
+    # Decodes and resamples several files at once and yields (path, wave, sr)
+    # in input order. At most `workers + prefetch` files are decoded ahead of
+    # the consumer, so memory stays bounded however long `paths` is.
+    # `transform` is applied to each wave in the worker; it must be picklable
+    # when `processes` is set.
+    executor_class = concurrent.futures.ProcessPoolExecutor if processes else concurrent.futures.ThreadPoolExecutor
+
+    with executor_class(max_workers=workers) as executor:
+        pending = collections.deque()
+        paths = iter(paths)
+
+        def submit():
+            for path in paths:
+                pending.append(executor.submit(_decode, path, sr, res_type, transform))
+                return True
+            return False
+
+        while len(pending) < workers + prefetch and submit():
+            pass
+
+        while len(pending) > 0:
+            result = pending.popleft().result()
+            submit()
+            yield result
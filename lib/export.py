@@ -0,0 +1,165 @@
+import copy
+import json
+import os
+
+import numpy as np
+import torch
+from torch import nn
+
+
+try:
+    import onnxruntime
+except ImportError:
+    onnxruntime = None
+
+
+EXPORT_FORMATS = {
+    'torchscript': '.ts',
+    'onnx': '.onnx',
+}
+
+
+class MaskPredictor(nn.Module):
+
+    def __init__(self, model):
+        super(MaskPredictor, self).__init__()
+        self.model = model
+
+    def forward(self, x):
+        return self.model.predict_mask(x)
+
+
+def model_config(model):
+    return {
+        'n_fft': model.n_fft,
+        'hop_length': model.hop_length,
+        'is_complex': model.is_complex,
+        'offset': model.offset,
+    }
+
+
+def prepare(model):
+    # works on a copy, so the eager model stays usable for the parity check
+    model = copy.deepcopy(model).cpu().fuse_for_inference()
+
+    return MaskPredictor(model).eval()
+
+
+def example_input(model, batchsize=4, cropsize=256, seed=0):
+    g = torch.Generator().manual_seed(seed)
+    shape = (batchsize, 2, model.n_fft // 2 + 1, cropsize)
+    if model.is_complex:
+        return torch.complex(torch.randn(shape, generator=g), torch.randn(shape, generator=g))
+
+    return torch.randn(shape, generator=g).abs()
+
+
+def export_torchscript(model, path, batchsize=4, cropsize=256):
+    predictor = prepare(model)
+    with torch.no_grad():
+        traced = torch.jit.trace(predictor, example_input(model, batchsize, cropsize))
+        traced = torch.jit.freeze(traced)
+
+    torch.jit.save(traced, path, _extra_files={'config.json': json.dumps(model_config(model))})
+
+
+def export_onnx(model, path, batchsize=4, cropsize=256, opset_version=17):
+    import onnx
+
+    if model.is_complex:
+        raise ValueError('complex models cannot be exported to ONNX, use torchscript')
+
+    predictor = prepare(model)
+    with torch.no_grad():
+        torch.onnx.export(
+            predictor, (example_input(model, batchsize, cropsize),), path,
+            input_names=['x'],
+            output_names=['mask'],
+            dynamic_axes={'x': {0: 'batch', 3: 'frames'}, 'mask': {0: 'batch', 3: 'frames'}},
+            opset_version=opset_version
+        )
+
+    proto = onnx.load(path)
+    entry = proto.metadata_props.add()
+    entry.key = 'config'
+    entry.value = json.dumps(model_config(model))
+    onnx.save(proto, path)
+
+
+def export_model(model, path, format='torchscript', batchsize=4, cropsize=256):
+    if format == 'torchscript':
+        export_torchscript(model, path, batchsize, cropsize)
+    elif format == 'onnx':
+        export_onnx(model, path, batchsize, cropsize)
+    else:
+        raise ValueError('unknown export format: {}'.format(format))
+
+
+class ExportedModel(object):
+    # stands in for CascadedNet inside inference.Separator
+
+    def __init__(self, config):
+        self.n_fft = config['n_fft']
+        self.hop_length = config['hop_length']
+        self.is_complex = config['is_complex']
+        self.offset = config['offset']
+
+    def eval(self):
+        return self
+
+    def to(self, device):
+        return self
+
+
+class TorchScriptModel(ExportedModel):
+
+    def __init__(self, path, device=None):
+        extra_files = {'config.json': ''}
+        self.module = torch.jit.load(path, map_location=device or 'cpu', _extra_files=extra_files)
+        super(TorchScriptModel, self).__init__(json.loads(extra_files['config.json']))
+
+    def predict_mask(self, x):
+        return self.module(x)
+
+
+class OnnxModel(ExportedModel):
+
+    def __init__(self, path, threads=0):
+        if onnxruntime is None:
+            raise ImportError('onnxruntime is required to run ONNX models')
+
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = threads
+        self.session = onnxruntime.InferenceSession(
+            path, options, providers=['CPUExecutionProvider']
+        )
+        config = self.session.get_modelmeta().custom_metadata_map['config']
+        super(OnnxModel, self).__init__(json.loads(config))
+
+    def predict_mask(self, x):
+        x = x.cpu().numpy().astype(np.float32)
+        mask = self.session.run(None, {'x': x})[0]
+
+        return torch.from_numpy(mask)
+
+
+def is_exported(path):
+    return os.path.splitext(path)[1] in EXPORT_FORMATS.values()
+
+
+def load_exported(path, device=None):
+    if os.path.splitext(path)[1] == EXPORT_FORMATS['onnx']:
+        return OnnxModel(path)
+
+    return TorchScriptModel(path, device)
+
+
+def parity_check(model, exported, batchsize=4, cropsize=256):
+    # max abs difference of the masks of the eager and the exported model
+    x = example_input(model, batchsize, cropsize, seed=1)
+    model.eval()
+    with torch.no_grad():
+        expected = model.predict_mask(x.to(next(model.parameters()).device)).cpu()
+        actual = exported.predict_mask(x).cpu()
+
+    return (expected - actual).abs().max().item()
@@ -5,6 +5,35 @@ import torch.nn.functional as F
 from lib import spec_utils
 
 
+def fold_batchnorm(module):
+    # replaces every Conv2d / Linear followed by a BatchNorm inside a Sequential
+    # with a single layer whose weights absorb the normalization (eval mode only)
+    for name, child in module.named_children():
+        fold_batchnorm(child)
+
+        if isinstance(child, nn.Sequential):
+            mods = list(child)
+            fused = []
+            i = 0
+            while i < len(mods):
+                if i + 1 < len(mods) and isinstance(mods[i + 1], nn.modules.batchnorm._BatchNorm):
+                    if isinstance(mods[i], nn.Conv2d):
+                        fused.append(nn.utils.fusion.fuse_conv_bn_eval(mods[i], mods[i + 1]))
+                        i += 2
+                        continue
+                    elif isinstance(mods[i], nn.Linear):
+                        fused.append(nn.utils.fusion.fuse_linear_bn_eval(mods[i], mods[i + 1]))
+                        i += 2
+                        continue
+                fused.append(mods[i])
+                i += 1
+
+            if len(fused) < len(mods):
+                setattr(module, name, nn.Sequential(*fused))
+
+    return module
+
+
 class Conv2DBNActiv(nn.Module):
 
     def __init__(self, nin, nout, ksize=3, stride=1, pad=1, dilation=1, activ=nn.ReLU):
@@ -3,9 +3,20 @@ from torch import nn
 import torch.nn.functional as F
 
 
+from lib import checkpoint
 from lib import layers
 
 
+DEFAULT_ARCH = {
+    'n_fft': 2048,
+    'hop_length': 1024,
+    'nout': 32,
+    'nout_lstm': 128,
+    'is_complex': False,
+    'stage2': True,
+}
+
+
 class BaseNet(nn.Module):
 
     def __init__(self, nin, nout, nin_lstm, nout_lstm, dilations=((4, 2), (8, 4), (12, 6))):
@@ -44,11 +55,15 @@ class BaseNet(nn.Module):
 
 class CascadedNet(nn.Module):
 
-    def __init__(self, n_fft, hop_length, nout=32, nout_lstm=128, is_complex=False):
+    def __init__(self, n_fft, hop_length, nout=32, nout_lstm=128, is_complex=False, stage2=True):
         super(CascadedNet, self).__init__()
         self.n_fft = n_fft
         self.hop_length = hop_length
         self.is_complex = is_complex
+        self.nout = nout
+        self.nout_lstm = nout_lstm
+        self.stage2 = stage2
+        self.fused = False
 
         self.max_bin = n_fft // 2
         self.output_bin = n_fft // 2 + 1
@@ -65,16 +80,19 @@ class CascadedNet(nn.Module):
             self.nin, nout // 4, self.nin_lstm // 2, nout_lstm // 2
         )
 
-        self.stg2_low_band_net = nn.Sequential(
-            BaseNet(nout // 4 + self.nin, nout, self.nin_lstm // 2, nout_lstm),
-            layers.Conv2DBNActiv(nout, nout // 2, 1, 1, 0)
-        )
-        self.stg2_high_band_net = BaseNet(
-            nout // 4 + self.nin, nout // 2, self.nin_lstm // 2, nout_lstm // 2
-        )
-
+        if stage2:
+            self.stg2_low_band_net = nn.Sequential(
+                BaseNet(nout // 4 + self.nin, nout, self.nin_lstm // 2, nout_lstm),
+                layers.Conv2DBNActiv(nout, nout // 2, 1, 1, 0)
+            )
+            self.stg2_high_band_net = BaseNet(
+                nout // 4 + self.nin, nout // 2, self.nin_lstm // 2, nout_lstm // 2
+            )
+
+        # the stage 1 (and stage 2) outputs are stacked on the input
+        nin_stg3 = (3 * nout // 4 if stage2 else nout // 4) + self.nin
         self.stg3_full_band_net = BaseNet(
-            3 * nout // 4 + self.nin, nout, self.nin_lstm, nout_lstm
+            nin_stg3, nout, self.nin_lstm, nout_lstm
         )
 
         self.out = nn.Conv2d(nout, self.nin * 2, 1, bias=False)
@@ -92,17 +110,21 @@ class CascadedNet(nn.Module):
         h1 = self.stg1_high_band_net(h1_in)
         aux1 = torch.cat([l1, h1], dim=2)
 
-        l2_in = torch.cat([l1_in, l1], dim=1)
-        h2_in = torch.cat([h1_in, h1], dim=1)
-        l2 = self.stg2_low_band_net(l2_in)
-        h2 = self.stg2_high_band_net(h2_in)
-        aux2 = torch.cat([l2, h2], dim=2)
+        if self.stage2:
+            l2_in = torch.cat([l1_in, l1], dim=1)
+            h2_in = torch.cat([h1_in, h1], dim=1)
+            l2 = self.stg2_low_band_net(l2_in)
+            h2 = self.stg2_high_band_net(h2_in)
+            aux2 = torch.cat([l2, h2], dim=2)
 
-        f3_in = torch.cat([x, aux1, aux2], dim=1)
+            f3_in = torch.cat([x, aux1, aux2], dim=1)
+        else:
+            f3_in = torch.cat([x, aux1], dim=1)
         f3 = self.stg3_full_band_net(f3_in)
 
         if self.is_complex:
-            mask = self.out(f3)
+            # complex half precision is barely supported, the mask is built in fp32 under autocast
+            mask = self.out(f3).float()
             mask = torch.complex(mask[:, :self.nin], mask[:, self.nin:])
             mask = self.bounded_mask(mask)
         else:
@@ -116,6 +138,30 @@ class CascadedNet(nn.Module):
 
         return mask
 
+    def arch(self):
+        return {
+            'n_fft': self.n_fft,
+            'hop_length': self.hop_length,
+            'nout': self.nout,
+            'nout_lstm': self.nout_lstm,
+            'is_complex': self.is_complex,
+            'stage2': self.stage2,
+        }
+
+    def fuse_for_inference(self):
+        # folds BatchNorm into the preceding convolutions, runs the activations
+        # in place and drops dropout; the model can only be used for inference afterwards
+        self.eval()
+        layers.fold_batchnorm(self)
+        for module in self.modules():
+            if isinstance(module, (nn.ReLU, nn.LeakyReLU)):
+                module.inplace = True
+            elif isinstance(module, (layers.Decoder, layers.ASPPModule)):
+                module.dropout = None
+        self.fused = True
+
+        return self
+
     def bounded_mask(self, mask, eps=1e-8):
         mask_mag = torch.abs(mask)
         mask = torch.tanh(mask_mag) * mask / (mask_mag + eps)
@@ -139,3 +185,49 @@ class CascadedNet(nn.Module):
             assert pred.size()[3] > 0
 
         return pred
+
+
+def save_checkpoint(model, path, sr=None):
+    # the weights together with the architecture and STFT settings they belong to;
+    # folded weights are flagged, they only fit a fused network
+    arch = dict(model.arch(), fused=True) if model.fused else model.arch()
+    checkpoint.save(path, arch, model.state_dict(), sr)
+
+
+def checkpoint_arch(header, n_fft=None, hop_length=None, is_complex=None):
+    # Plain state dicts (older checkpoints) are the baseline size with the
+    # given (or default) STFT settings.
+    if 'arch' in header:
+        return dict(DEFAULT_ARCH, **header['arch'])
+
+    arch = dict(DEFAULT_ARCH)
+    for key, value in [('n_fft', n_fft), ('hop_length', hop_length), ('is_complex', is_complex)]:
+        if value is not None:
+            arch[key] = value
+
+    return arch
+
+
+def read_arch(path):
+    # the architecture and STFT settings of a checkpoint without building the network
+    header, _ = checkpoint.load(path)
+
+    return checkpoint_arch(header)
+
+
+def load_checkpoint(path, n_fft=None, hop_length=None, is_complex=None, verify=False):
+    # Builds the network a checkpoint was trained with.
+    header, state_dict = checkpoint.load(path, verify)
+    arch = checkpoint_arch(header, n_fft, hop_length, is_complex)
+    fused = arch.pop('fused', False)
+    model = CascadedNet(**arch)
+    if fused:
+        # BatchNorm is already folded into the stored weights, the network is
+        # fused first so its layers match them
+        model.fuse_for_inference()
+    # the parameters keep pointing into the memory-mapped file instead of being copied
+    model.load_state_dict(state_dict, assign=True)
+    model.sr = header.get('sr')
+    model.checkpoint_hash = header.get('hash')
+
+    return model
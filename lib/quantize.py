@@ -0,0 +1,36 @@
+import torch
+from torch import nn
+from torch.ao import quantization
+
+from lib import layers
+
+
+PRECISIONS = ['fp32', 'bf16', 'int8']
+
+
+def quantize_dynamic(model):
+    # int8 weights for the LSTM and Linear layers, activations are quantized on the fly
+    return quantization.quantize_dynamic(model, {nn.LSTM, nn.Linear}, dtype=torch.qint8)
+
+
+def prepare_static(model, backend='x86'):
+    # Puts the convolution of every Conv2DBNActiv between quant/dequant stubs
+    # and inserts observers. The rest of the network (interpolation, concat,
+    # LSTM, output layer) stays in float.
+    torch.backends.quantized.engine = backend
+    model.fuse_for_inference()
+
+    qconfig = quantization.get_default_qconfig(backend)
+    for module in model.modules():
+        if isinstance(module, layers.Conv2DBNActiv):
+            conv = module.conv
+            if isinstance(conv[1], nn.ReLU):
+                conv = quantization.fuse_modules(conv, [['0', '1']])
+            module.conv = nn.Sequential(quantization.QuantStub(), *conv, quantization.DeQuantStub())
+            module.conv.qconfig = qconfig
+
+    return quantization.prepare(model, inplace=True)
+
+
+def convert_static(model):
+    return quantization.convert(model, inplace=True)
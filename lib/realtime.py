@@ -0,0 +1,140 @@
+import numpy as np
+import torch
+
+from lib import spec_utils
+
+
+class FrameRing(object):
+    # fixed size ring buffer of the most recent STFT frames
+
+    def __init__(self, channels, bins, capacity, dtype=np.complex64):
+        self.frames = np.zeros((channels, bins, capacity), dtype=dtype)
+        self.capacity = capacity
+        self.pos = 0  # total number of frames pushed
+
+    def push(self, frames):
+        n = frames.shape[2]
+        if n >= self.capacity:
+            frames = frames[:, :, n - self.capacity:]
+            n = self.capacity
+        idx = (self.pos + np.arange(n)) % self.capacity
+        self.frames[:, :, idx] = frames
+        self.pos += frames.shape[2]
+
+    def latest(self, n, end=None):
+        # the n frames before frame `end` (default: the newest), oldest first;
+        # frames from before the start of the stream are zero
+        end = self.pos if end is None else end
+        idx = np.arange(end - n, end)
+        out = self.frames[:, :, idx % self.capacity]
+        out[:, :, idx < 0] = 0
+
+        return out
+
+
+class RealtimeSeparator(object):
+    # Separates a live stream block by block. Every block of samples adds STFT
+    # frames to a ring buffer; frame t is separated once `lookahead` frames
+    # after it have arrived, from a window of `offset` frames of past context,
+    # the frames up to t + lookahead and zeros for the rest of the model's
+    # right context. The model runs on a patch just wide enough for a block of
+    # frames, so the work per block and the latency do not depend on the song.
+
+    def __init__(self, model, device=None, block_frames=8, lookahead=16, channels=2, peak=None):
+        self.model = model
+        self.device = device
+        self.n_fft = model.n_fft
+        self.hop_length = model.hop_length
+        self.offset = model.offset
+        self.is_complex = model.is_complex
+        self.block_frames = block_frames
+        self.lookahead = min(lookahead, self.offset)
+
+        # smallest patch (a multiple of 16 for the U-Net) whose output covers a block
+        self.cropsize = int(np.ceil((2 * self.offset + block_frames) / 16)) * 16
+        self.roi_size = self.cropsize - 2 * self.offset
+
+        self.stft = spec_utils.StreamingSTFT(self.n_fft, self.hop_length, channels)
+        self.istft_y = spec_utils.StreamingISTFT(self.n_fft, self.hop_length, channels)
+        self.istft_v = spec_utils.StreamingISTFT(self.n_fft, self.hop_length, channels)
+        self.ring = FrameRing(channels, self.n_fft // 2 + 1, self.cropsize)
+        self.n_done = 0  # frames separated so far
+        # the offline path normalizes by the loudest bin of the song, live input
+        # uses the loudest bin seen so far (or a fixed level when given)
+        self.fixed_peak = peak
+        self.peak = peak or 0
+
+        self.model.eval()
+
+    def latency(self):
+        # algorithmic latency in samples, on top of the input block: a sample is
+        # final once the last frame overlapping it (n_fft / 2 later) and that
+        # frame's look-ahead are complete (another n_fft / 2 plus the look-ahead)
+        return self.n_fft + self.lookahead * self.hop_length
+
+    def _run(self, X_window):
+        if self.fixed_peak is None:
+            self.peak = max(self.peak, np.abs(X_window).max())
+        X = X_window / max(self.peak, 1e-8)
+        X_batch = torch.from_numpy(X[None]).to(self.device)
+        if not self.is_complex:
+            X_batch = torch.abs(X_batch)
+
+        with torch.no_grad():
+            mask = self.model.predict_mask(X_batch)
+
+        return mask[0].cpu().numpy()
+
+    def _separate(self, end):
+        # separates the frames [n_done, end - lookahead) with the frames up to `end` known
+        ys, vs = [], []
+        while self.n_done < end - self.lookahead:
+            n = min(end - self.lookahead - self.n_done, self.roi_size)
+            # window whose output region ends right after frame n_done + n - 1
+            last = self.n_done + n
+            known = min(end, last + self.offset)
+            window = self.ring.latest(self.cropsize - (last + self.offset - known), end=known)
+            window = np.pad(window, ((0, 0), (0, 0), (0, last + self.offset - known)))
+
+            mask = self._run(window)[:, :, self.roi_size - n:]
+            X_roi = window[:, :, self.offset + self.roi_size - n:self.offset + self.roi_size]
+            ys.append(X_roi * mask[:2])
+            vs.append(X_roi * mask[2:])
+            self.n_done += n
+
+        if len(ys) == 0:
+            return None, None
+
+        return np.concatenate(ys, axis=2), np.concatenate(vs, axis=2)
+
+    def _push_frames(self, frames):
+        # feeds the ring at most a block at a time, so the context of every
+        # frame still to be separated is in it
+        ys, vs = [], []
+        for i in range(0, frames.shape[2], self.block_frames):
+            self.ring.push(frames[:, :, i:i + self.block_frames])
+            y_spec, v_spec = self._separate(self.ring.pos)
+            if y_spec is not None:
+                ys.append(self.istft_y.push(y_spec))
+                vs.append(self.istft_v.push(v_spec))
+
+        if len(ys) == 0:
+            empty = np.zeros((frames.shape[0], 0), dtype=np.float32)
+            return empty, empty.copy()
+
+        return np.concatenate(ys, axis=1), np.concatenate(vs, axis=1)
+
+    def push(self, wave):
+        # wave: (channels, samples) -> (instruments, vocals) samples that are final
+        return self._push_frames(self.stft.push(wave))
+
+    def flush(self):
+        y1, v1 = self._push_frames(self.stft.flush())
+        # the look-ahead of the last frames is past the end of the stream
+        zeros = np.zeros(self.ring.frames.shape[:2] + (self.lookahead,), dtype=np.complex64)
+        y2, v2 = self._push_frames(zeros)
+
+        return (
+            np.concatenate([y1, y2, self.istft_y.flush()], axis=1),
+            np.concatenate([v1, v2, self.istft_v.flush()], axis=1)
+        )
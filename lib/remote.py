@@ -0,0 +1,151 @@
+import io
+import json
+import os
+import socket
+
+import numpy as np
+
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 5940
+
+
+def parse_address(address):
+    if address is None or address == '':
+        return DEFAULT_HOST, DEFAULT_PORT
+
+    host, _, port = address.rpartition(':')
+    if host == '':
+        host = DEFAULT_HOST
+
+    return host, int(port)
+
+
+def send_message(wfile, header, arrays=None):
+    # A message is one JSON header line followed by the raw `.npy` payloads
+    # of the arrays listed in header['arrays'], in order.
+    arrays = arrays or {}
+    payloads = []
+    header = dict(header)
+    header['arrays'] = []
+    for name, array in arrays.items():
+        buf = io.BytesIO()
+        np.save(buf, np.ascontiguousarray(array), allow_pickle=False)
+        payload = buf.getvalue()
+        header['arrays'].append({'name': name, 'nbytes': len(payload)})
+        payloads.append(payload)
+
+    wfile.write(json.dumps(header, ensure_ascii=False).encode('utf8') + b'\n')
+    for payload in payloads:
+        wfile.write(payload)
+    wfile.flush()
+
+
+def recv_message(rfile):
+    line = rfile.readline()
+    if not line:
+        return None, None
+
+    header = json.loads(line.decode('utf8'))
+    arrays = {}
+    for meta in header.pop('arrays', []):
+        payload = rfile.read(meta['nbytes'])
+        if len(payload) != meta['nbytes']:
+            raise ConnectionError('connection closed while reading `{}`'.format(meta['name']))
+        arrays[meta['name']] = np.load(io.BytesIO(payload), allow_pickle=False)
+
+    return header, arrays
+
+
+class SeparationClient(object):
+
+    def __init__(
+            self, address=None, pretrained_model=None, gpu=-1, n_fft=2048, hop_length=1024,
+            batchsize=None, cropsize=None, is_complex=False, tta_shifts=2, cheap_tta=False, timeout=None,
+            tta_weights=None, tta_threshold=0.2, silence_threshold=None):
+        self.address = parse_address(address)
+        self.timeout = timeout
+        self.model_options = {
+            'pretrained_model': os.path.abspath(pretrained_model) if pretrained_model else None,
+            'gpu': gpu,
+            'n_fft': n_fft,
+            'hop_length': hop_length,
+            'batchsize': batchsize,
+            'cropsize': cropsize,
+            'complex': is_complex,
+            'tta_shifts': tta_shifts,
+            'cheap_tta': cheap_tta,
+            'tta_weights': tta_weights,
+            'tta_threshold': tta_threshold,
+            'silence_threshold': silence_threshold,
+        }
+        self.sock = None
+        self.rfile = None
+        self.wfile = None
+
+    def connect(self):
+        if self.sock is None:
+            self.sock = socket.create_connection(self.address, timeout=self.timeout)
+            self.rfile = self.sock.makefile('rb')
+            self.wfile = self.sock.makefile('wb')
+
+    def close(self):
+        if self.sock is not None:
+            self.rfile.close()
+            self.wfile.close()
+            self.sock.close()
+            self.sock = None
+
+    def __enter__(self):
+        self.connect()
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def request(self, command, arrays=None, **kwargs):
+        self.connect()
+        header = dict(self.model_options)
+        header.update(kwargs)
+        header['command'] = command
+        send_message(self.wfile, header, arrays)
+
+        reply, reply_arrays = recv_message(self.rfile)
+        if reply is None:
+            self.close()
+            raise ConnectionError('separation server closed the connection')
+        if not reply.get('ok', False):
+            raise RuntimeError('separation server error: {}'.format(reply.get('error')))
+
+        return reply, reply_arrays
+
+    def ping(self):
+        reply, _ = self.request('ping')
+        return reply
+
+    def settings(self):
+        # {'batchsize', 'cropsize'} the server uses for this model when the job does not set them
+        reply, _ = self.request('settings')
+        return {'batchsize': reply['batchsize'], 'cropsize': reply['cropsize']}
+
+    def separate_file(self, input_path, sr=44100, tta=False, output_dir='', output_image=False):
+        # the server resolves paths against its own working directory
+        output_dir = os.path.abspath(output_dir) if output_dir != '' else os.getcwd()
+        reply, _ = self.request(
+            'separate_file',
+            input=os.path.abspath(input_path),
+            sr=sr,
+            tta=tta,
+            output_dir=output_dir,
+            output_image=output_image
+        )
+
+        return reply['instruments'], reply['vocals']
+
+    def separate(self, X_spec):
+        _, arrays = self.request('separate', arrays={'X_spec': X_spec}, tta=False)
+        return arrays['y_spec'], arrays['v_spec']
+
+    def separate_tta(self, X_spec):
+        _, arrays = self.request('separate', arrays={'X_spec': X_spec}, tta=True)
+        return arrays['y_spec'], arrays['v_spec']
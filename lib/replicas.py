@@ -0,0 +1,213 @@
+import os
+import queue
+import time
+
+import numpy as np
+import torch
+import torch.multiprocessing as mp
+from torch import nn
+
+from lib import nets
+
+
+def parse_cores(spec):
+    # '0-15,32-47' -> [0, ..., 15, 32, ..., 47]
+    cores = []
+    for part in spec.split(','):
+        if '-' in part:
+            start, end = part.split('-')
+            cores.extend(range(int(start), int(end) + 1))
+        elif part != '':
+            cores.append(int(part))
+
+    return cores
+
+
+def available_cores():
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+
+    return list(range(os.cpu_count()))
+
+
+def split_cores(cores, replicas, threads=None):
+    # consecutive core ids usually share a NUMA node, so each replica gets a contiguous block
+    if threads is None:
+        threads = max(1, len(cores) // replicas)
+
+    return [
+        [cores[(k * threads + t) % len(cores)] for t in range(threads)]
+        for k in range(replicas)
+    ]
+
+
+def set_threads(threads, interop_threads=1):
+    torch.set_num_threads(threads)
+    try:
+        torch.set_num_interop_threads(interop_threads)
+    except RuntimeError:
+        # can only be set once, before any inter-op parallel work has started
+        pass
+
+
+def _replica_main(model, cores, precision, tasks, results):
+    if hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, cores)
+    set_threads(len(cores))
+    if isinstance(model, tuple):
+        # (checkpoint path, fused): memory-mapped by every replica, so a fused
+        # checkpoint is shared through the page cache instead of copied per process
+        path, fused = model
+        model = nets.load_checkpoint(path)
+        if fused:
+            model.fuse_for_inference()
+    model.eval()
+
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+
+        generation, idx, X_batch = task
+        try:
+            X_batch = torch.from_numpy(X_batch)
+            if not model.is_complex:
+                X_batch = torch.abs(X_batch)
+
+            with torch.no_grad(), torch.autocast('cpu', dtype=torch.bfloat16, enabled=precision == 'bf16'):
+                mask = model.predict_mask(X_batch)
+
+            # complex masks stay complex
+            mask = mask if mask.is_complex() else mask.float()
+            results.put((generation, idx, mask.numpy(), None))
+        except Exception as e:
+            results.put((generation, idx, None, repr(e)))
+
+
+class ReplicaPool(object):
+    # N copies of the model in worker processes, each pinned to its own core set
+    # with its own intra-op thread count; batches are spread across them.
+
+    def __init__(self, model, replicas=2, threads=None, cores=None, precision='fp32', inflight=2):
+        if not isinstance(model, nn.Module):
+            raise ValueError('replicas need a .pth checkpoint, not an exported model')
+
+        cores = cores or available_cores()
+        self.core_sets = split_cores(cores, replicas, threads)
+        self.max_inflight = inflight * replicas
+        self.generation = 0
+
+        ctx = mp.get_context('spawn')
+        self.tasks = ctx.Queue()
+        self.results = ctx.Queue()
+        if getattr(model, 'checkpoint_path', None) is not None and precision != 'int8':
+            # the replicas load the checkpoint themselves instead of unpickling a copy
+            model = (model.checkpoint_path, model.fused)
+        else:
+            model = model.cpu()
+        self.workers = [
+            ctx.Process(
+                target=_replica_main,
+                args=(model, core_set, precision, self.tasks, self.results),
+                daemon=True
+            )
+            for core_set in self.core_sets
+        ]
+        for worker in self.workers:
+            worker.start()
+
+    def imap(self, batches):
+        # (keys, X_batch) in, (keys, mask) out in the same order
+        self.generation += 1
+        generation = self.generation
+        batches = iter(batches)
+        keys = {}
+        done = {}
+        next_in = next_out = 0
+        exhausted = False
+
+        while True:
+            while not exhausted and next_in - next_out < self.max_inflight:
+                try:
+                    batch_keys, X_batch = next(batches)
+                except StopIteration:
+                    exhausted = True
+                    break
+                keys[next_in] = batch_keys
+                self.tasks.put((generation, next_in, np.asarray(X_batch)))
+                next_in += 1
+
+            if next_out == next_in:
+                return
+
+            while next_out not in done:
+                result_generation, idx, mask, error = self._get_result()
+                if result_generation != generation:
+                    # left over from an abandoned call
+                    continue
+                if error is not None:
+                    raise RuntimeError('replica failed: {}'.format(error))
+                done[idx] = mask
+
+            yield keys.pop(next_out), done.pop(next_out)
+            next_out += 1
+
+    def _get_result(self, poll_interval=1.0):
+        # waits for a result, but raises instead of blocking forever when a
+        # replica died (killed, out of memory, failed to start)
+        while True:
+            try:
+                return self.results.get(timeout=poll_interval)
+            except queue.Empty:
+                for worker in self.workers:
+                    if not worker.is_alive():
+                        # the other replicas may be stuck on a queue lock the dead one held
+                        self.terminate()
+                        raise RuntimeError('replica {} exited with code {}'.format(worker.pid, worker.exitcode))
+
+    def terminate(self):
+        for worker in self.workers:
+            if worker.is_alive():
+                worker.terminate()
+            worker.join()
+        # batches no replica will read would otherwise keep the process from exiting
+        self.tasks.cancel_join_thread()
+
+    def close(self, timeout=30):
+        for worker in self.workers:
+            if worker.is_alive():
+                self.tasks.put(None)
+        for worker in self.workers:
+            worker.join(timeout)
+        self.terminate()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def benchmark(model, cores=None, batchsize=4, cropsize=256, n_batches=8, precision='fp32'):
+    # throughput in patches per second for every replicas x threads split of the cores
+    cores = cores or available_cores()
+    shape = (batchsize, 2, model.n_fft // 2 + 1, cropsize)
+    X_batch = np.random.RandomState(0).rand(*shape).astype(np.complex64 if model.is_complex else np.float32)
+
+    results = []
+    for replicas in range(1, len(cores) + 1):
+        if len(cores) % replicas != 0:
+            continue
+        threads = len(cores) // replicas
+        with ReplicaPool(model, replicas, threads, cores, precision) as pool:
+            # warm up every replica once
+            list(pool.imap(([None], X_batch) for _ in range(replicas)))
+
+            n = max(n_batches, 2 * replicas)
+            start = time.perf_counter()
+            list(pool.imap(([None], X_batch) for _ in range(n)))
+            elapsed = time.perf_counter() - start
+
+        results.append((replicas, threads, n * batchsize / elapsed))
+
+    return results
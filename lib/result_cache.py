@@ -0,0 +1,235 @@
+import contextlib
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:
+    # Windows
+    fcntl = None
+    import msvcrt
+
+from lib import checkpoint
+
+
+DEFAULT_CACHE_DIR = 'cache'
+DEFAULT_CACHE_SIZE = 10 * 1024 ** 3
+
+_checkpoint_hashes = {}
+
+
+def file_hash(path, chunksize=1 << 20):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunksize), b''):
+            h.update(chunk)
+
+    return h.hexdigest()
+
+
+def checkpoint_hash(path):
+    # checkpoints are large, so the hash is remembered per (path, size, mtime);
+    # self-describing checkpoints carry the hash of their weights
+    stat = os.stat(path)
+    key = (os.path.abspath(path), stat.st_size, stat.st_mtime)
+    if key not in _checkpoint_hashes:
+        embedded = None
+        if os.path.splitext(path)[1] == '.pth':
+            embedded = checkpoint.read_hash(path)
+        _checkpoint_hashes[key] = embedded or file_hash(path)
+
+    return _checkpoint_hashes[key]
+
+
+def files_hash(paths):
+    # the content of a set of files, whatever their order or names
+    h = hashlib.sha256()
+    for digest in sorted(file_hash(path) for path in paths):
+        h.update(digest.encode('utf8'))
+
+    return h.hexdigest()
+
+
+def cache_key(wave, sr, model_hash, n_fft, hop_length, cropsize, tta, is_complex, silence_threshold=None):
+    h = hashlib.sha256()
+    h.update(np.ascontiguousarray(wave, dtype=np.float32).tobytes())
+    settings = {
+        'sr': sr,
+        'model': model_hash,
+        'n_fft': n_fft,
+        'hop_length': hop_length,
+        'cropsize': cropsize,
+        'tta': tta,
+        'complex': is_complex,
+        'silence_threshold': silence_threshold,
+    }
+    h.update(json.dumps(settings, sort_keys=True).encode('utf8'))
+
+    return h.hexdigest()
+
+
+class ResultCache(object):
+
+    def __init__(self, root=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_CACHE_SIZE):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.index_path = os.path.join(root, 'index.json')
+        self.lock_path = os.path.join(root, 'index.lock')
+        self.lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+    @contextlib.contextmanager
+    def _locked(self):
+        # the thread lock serializes this process, the lock file the processes
+        # (server, CLI, GUI) sharing the cache directory; the index is always
+        # re-read under both
+        with self.lock, open(self.lock_path, 'a+b') as f:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            else:
+                f.seek(0)
+                while True:
+                    try:
+                        msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                        break
+                    except OSError:
+                        # LK_LOCK gives up after about 10 seconds
+                        pass
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+                else:
+                    f.seek(0)
+                    msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+    def _load_index(self):
+        if not os.path.exists(self.index_path):
+            return {}
+
+        with open(self.index_path, 'r', encoding='utf8') as f:
+            return json.load(f)
+
+    def _save_index(self, index):
+        tmp_path = '{}.{}.tmp'.format(self.index_path, os.getpid())
+        with open(tmp_path, 'w', encoding='utf8') as f:
+            json.dump(index, f, ensure_ascii=False, indent=1)
+        os.replace(tmp_path, self.index_path)
+
+    def get(self, key):
+        # returns {name: path} of the cached files, or None on a miss
+        with self._locked():
+            index = self._load_index()
+            entry = index.get(key)
+            if entry is None:
+                return None
+
+            files = {
+                name: os.path.join(self.root, key, fname)
+                for name, fname in entry['files'].items()
+            }
+            if not all(os.path.exists(path) for path in files.values()):
+                self._remove(index, key)
+                self._save_index(index)
+                return None
+
+            entry['last_used'] = time.time()
+            entry['hits'] = entry.get('hits', 0) + 1
+            self._save_index(index)
+
+        return files
+
+    def fetch(self, key, targets):
+        # copies the cached files {name: destination} out, only if all of them are cached
+        files = self.get(key)
+        if files is None or not all(name in files for name in targets):
+            return False
+
+        for name, path in targets.items():
+            shutil.copyfile(files[name], path)
+
+        return True
+
+    def put(self, key, files, source=None):
+        # copies {name: path} into the entry of `key`, adding to what is there
+        entry_dir = os.path.join(self.root, key)
+        os.makedirs(entry_dir, exist_ok=True)
+
+        with self._locked():
+            index = self._load_index()
+            entry = index.setdefault(key, {
+                'files': {},
+                'bytes': 0,
+                'created': time.time(),
+                'hits': 0,
+                'source': source,
+            })
+
+            for name, path in files.items():
+                fname = name + os.path.splitext(path)[1]
+                shutil.copyfile(path, os.path.join(entry_dir, fname))
+                entry['files'][name] = fname
+
+            entry['bytes'] = sum(
+                os.path.getsize(os.path.join(entry_dir, fname))
+                for fname in entry['files'].values()
+            )
+            entry['last_used'] = time.time()
+
+            self._evict(index, keep=key)
+            self._save_index(index)
+
+    def _remove(self, index, key):
+        shutil.rmtree(os.path.join(self.root, key), ignore_errors=True)
+        index.pop(key, None)
+
+    def _evict(self, index, keep=None):
+        # drops the least recently used entries until the cache fits
+        total = sum(entry['bytes'] for entry in index.values())
+        for key in sorted(index, key=lambda k: index[k]['last_used']):
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            total -= index[key]['bytes']
+            self._remove(index, key)
+
+    def entries(self):
+        with self._locked():
+            index = self._load_index()
+
+        return sorted(index.items(), key=lambda kv: kv[1]['last_used'], reverse=True)
+
+    def total_bytes(self):
+        return sum(entry['bytes'] for _, entry in self.entries())
+
+    def evict(self, max_bytes=None):
+        with self._locked():
+            if max_bytes is not None:
+                self.max_bytes = max_bytes
+            index = self._load_index()
+            self._evict(index)
+            self._save_index(index)
+
+    def purge(self, keys=None, older_than=None):
+        # removes the given entries, the ones unused for `older_than` seconds, or everything
+        with self._locked():
+            index = self._load_index()
+            if keys is None:
+                keys = list(index)
+            keys = [k for k in keys if k in index]
+            if older_than is not None:
+                keys = [k for k in keys if index[k]['last_used'] < time.time() - older_than]
+
+            for key in keys:
+                self._remove(index, key)
+            self._save_index(index)
+
+        return len(keys)
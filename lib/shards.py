@@ -0,0 +1,111 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+from tqdm import tqdm
+
+from lib import spec_utils
+
+
+# Packed training spectrograms: one flat data file per split with the X, y
+# and v spectrograms of every song, stored frame-major like the .npy caches
+# ((frames, channels, bins) per array), and a small json index of offsets,
+# shapes and normalization coefficients.
+
+
+def shard_name(training_set, sr, hop_length, n_fft):
+    # the shard of a split depends on which songs are in it and on the content
+    # and format of their caches (from the sidecar checksums), so rewriting a
+    # cache with convert.py or convert_cache.py makes a new shard
+    h = hashlib.sha256()
+    for entry in sorted(training_set, key=lambda entry: entry[:3]):
+        paths = entry[:3]
+        h.update('\n'.join(paths).encode('utf8'))
+        h.update(spec_utils.caches_checksum(paths).encode('utf8'))
+
+    return 'sr{}_hl{}_nf{}_{}'.format(sr, hop_length, n_fft, h.hexdigest()[:12])
+
+
+def pack(training_set, path):
+    # training_set: [X_cache_path, y_cache_path, v_cache_path, coef] as made by
+    # dataset.make_training_set
+    songs = []
+    dtype = cache_format = None
+    offset = 0
+    tmp_path = path + '.data.tmp'
+    with open(tmp_path, 'wb') as f:
+        for X_path, y_path, v_path, coef in tqdm(training_set):
+            song = {'name': os.path.basename(X_path), 'coef': float(coef)}
+            for key, npy_path in [('X', X_path), ('y', y_path), ('v', v_path)]:
+                array = np.load(npy_path, mmap_mode='r')
+                if dtype is None:
+                    dtype = array.dtype
+                    cache_format = spec_utils.cache_format_of(array)
+                elif array.dtype != dtype:
+                    raise ValueError('{} is not in the cache format of the other songs'.format(npy_path))
+                array = np.ascontiguousarray(array)
+                if hashlib.sha256(array.data).hexdigest() != spec_utils.read_cache_meta(npy_path)['sha256']:
+                    raise ValueError('{} does not match the checksum in its sidecar'.format(npy_path))
+                f.write(array.tobytes())
+                song[key] = offset
+                song['shape'] = list(array.shape)
+                offset += array.size
+            songs.append(song)
+
+    index = {'dtype': np.dtype(dtype).str, 'format': cache_format, 'songs': songs}
+    with open(path + '.json.tmp', 'w', encoding='utf8') as f:
+        json.dump(index, f)
+    # the index is renamed last, so a shard with an index is complete
+    os.replace(tmp_path, path + '.data')
+    os.replace(path + '.json.tmp', path + '.json')
+
+
+def exists(path):
+    return os.path.exists(path + '.json') and os.path.exists(path + '.data')
+
+
+class ShardStore(object):
+
+    def __init__(self, path):
+        self.path = path
+        with open(path + '.json', 'r', encoding='utf8') as f:
+            index = json.load(f)
+        self.dtype = np.dtype(index['dtype'])
+        self.format = index['format']
+        self.songs = index['songs']
+        self.data = None
+
+    def __len__(self):
+        return len(self.songs)
+
+    def __getstate__(self):
+        # DataLoader workers open the file themselves instead of receiving a copy
+        state = self.__dict__.copy()
+        state['data'] = None
+        return state
+
+    def _open(self):
+        if self.data is None:
+            self.data = np.memmap(self.path + '.data', dtype=self.dtype, mode='r')
+
+        return self.data
+
+    def training_set(self):
+        # [song index, coef] entries for dataset.VocalRemoverTrainingSet
+        return [[i, song['coef']] for i, song in enumerate(self.songs)]
+
+    def n_frames(self, idx):
+        return self.songs[idx]['shape'][0]
+
+    def crop(self, idx, start, cropsize):
+        # read-only (frames, channels, bins[, 2]) views of X, y and v, in the cache format
+        data = self._open()
+        song = self.songs[idx]
+        row_size = int(np.prod(song['shape'][1:]))
+        shape = (cropsize,) + tuple(song['shape'][1:])
+
+        return [
+            data[song[key] + start * row_size:song[key] + (start + cropsize) * row_size].reshape(shape)
+            for key in ['X', 'y', 'v']
+        ]
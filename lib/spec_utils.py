@@ -1,8 +1,17 @@
+import functools
+import hashlib
+import json
 import os
 
 import librosa
 import numpy as np
 import soundfile as sf
+import torch
+
+try:
+    import scipy.fft as fftlib
+except ImportError:
+    fftlib = None
 
 
 def crop_center(h1, h2):
@@ -23,12 +32,156 @@ def crop_center(h1, h2):
     return h1
 
 
-def wave_to_spectrogram(wave, hop_length, n_fft):
-    spec_left = librosa.stft(wave[0], n_fft=n_fft, hop_length=hop_length)
-    spec_right = librosa.stft(wave[1], n_fft=n_fft, hop_length=hop_length)
-    spec = np.asarray([spec_left, spec_right])
+@functools.lru_cache(maxsize=None)
+def hann_window(n_fft):
+    # periodic hann window, identical to the one librosa.stft uses
+    return np.hanning(n_fft + 1)[:-1].astype(np.float32)
+
+
+class LibrosaBackend(object):
+
+    name = 'librosa'
+
+    def stft(self, wave, n_fft, hop_length):
+        # librosa transforms all leading (channel) axes in one call
+        return librosa.stft(wave, n_fft=n_fft, hop_length=hop_length, dtype=np.complex64)
+
+    def istft(self, spec, n_fft, hop_length):
+        return librosa.istft(spec, n_fft=n_fft, hop_length=hop_length, dtype=np.float32)
+
+
+class NumpyBackend(object):
+
+    name = 'numpy'
+
+    def __init__(self, workers=-1, block_frames=1024):
+        # scipy.fft runs the per-frame transforms on several threads
+        self.workers = workers
+        self.block_frames = block_frames
+
+    def _rfft(self, x):
+        if fftlib is not None:
+            return fftlib.rfft(x, axis=-1, workers=self.workers)
+        return np.fft.rfft(x, axis=-1)
+
+    def _irfft(self, x, n):
+        if fftlib is not None:
+            return fftlib.irfft(x, n=n, axis=-1, workers=self.workers)
+        return np.fft.irfft(x, n=n, axis=-1)
+
+    def stft(self, wave, n_fft, hop_length):
+        window = hann_window(n_fft)
+        pad = [(0, 0)] * (wave.ndim - 1) + [(n_fft // 2, n_fft // 2)]
+        wave = np.pad(wave.astype(np.float32, copy=False), pad, mode='constant')
+
+        n_frames = 1 + (wave.shape[-1] - n_fft) // hop_length
+        frames = np.lib.stride_tricks.sliding_window_view(wave, n_fft, axis=-1)[..., ::hop_length, :]
+
+        spec = np.empty(wave.shape[:-1] + (n_fft // 2 + 1, n_frames), dtype=np.complex64)
+        for start in range(0, n_frames, self.block_frames):
+            end = min(start + self.block_frames, n_frames)
+            block = self._rfft(frames[..., start:end, :] * window)
+            spec[..., start:end] = np.swapaxes(block, -1, -2)
+
+        return spec
+
+    def istft(self, spec, n_fft, hop_length):
+        window = hann_window(n_fft)
+        n_frames = spec.shape[-1]
+        length = n_fft + hop_length * (n_frames - 1)
+
+        wave = np.zeros(spec.shape[:-2] + (length,), dtype=np.float32)
+        norm = np.zeros(length, dtype=np.float32)
+        for start in range(0, n_frames, self.block_frames):
+            end = min(start + self.block_frames, n_frames)
+            frames = self._irfft(np.swapaxes(spec[..., start:end], -1, -2), n_fft) * window
+            for i in range(end - start):
+                pos = (start + i) * hop_length
+                wave[..., pos:pos + n_fft] += frames[..., i, :]
+
+        win_sq = window ** 2
+        for i in range(n_frames):
+            norm[i * hop_length:i * hop_length + n_fft] += win_sq
+
+        nonzero = norm > np.finfo(np.float32).tiny
+        wave[..., nonzero] /= norm[nonzero]
+
+        return wave[..., n_fft // 2:length - n_fft // 2]
+
+
+class TorchBackend(object):
+
+    name = 'torch'
 
-    return spec
+    def __init__(self, device=None):
+        self.device = torch.device('cpu') if device is None else torch.device(device)
+        self.windows = {}
+
+    def _window(self, n_fft):
+        if n_fft not in self.windows:
+            self.windows[n_fft] = torch.hann_window(n_fft).to(self.device)
+        return self.windows[n_fft]
+
+    def stft(self, wave, n_fft, hop_length):
+        x = torch.from_numpy(np.ascontiguousarray(wave, dtype=np.float32)).to(self.device)
+        shape = x.shape
+        spec = torch.stft(
+            x.reshape(-1, shape[-1]), n_fft, hop_length,
+            window=self._window(n_fft),
+            center=True,
+            pad_mode='constant',
+            return_complex=True
+        )
+        spec = spec.reshape(shape[:-1] + spec.shape[-2:])
+
+        return spec.cpu().numpy().astype(np.complex64, copy=False)
+
+    def istft(self, spec, n_fft, hop_length):
+        x = torch.from_numpy(np.ascontiguousarray(spec, dtype=np.complex64)).to(self.device)
+        shape = x.shape
+        wave = torch.istft(
+            x.reshape((-1,) + shape[-2:]), n_fft, hop_length,
+            window=self._window(n_fft),
+            center=True
+        )
+        wave = wave.reshape(shape[:-2] + wave.shape[-1:])
+
+        return wave.cpu().numpy()
+
+
+BACKENDS = {
+    'librosa': LibrosaBackend,
+    'numpy': NumpyBackend,
+    'torch': TorchBackend,
+}
+
+_backend = LibrosaBackend()
+
+
+def get_backend(name=None, device=None):
+    if name is None:
+        return _backend
+    if name == 'torch':
+        return TorchBackend(device)
+
+    return BACKENDS[name]()
+
+
+def set_backend(name, device=None):
+    global _backend
+    _backend = get_backend(name, device)
+
+    return _backend
+
+
+def wave_to_spectrogram(wave, hop_length, n_fft, backend=None, dtype=np.complex64):
+    backend = backend or _backend
+    spec = backend.stft(wave, n_fft, hop_length)
+
+    if np.issubdtype(dtype, np.complexfloating):
+        return spec.astype(dtype, copy=False)
+
+    return np.abs(spec).astype(dtype, copy=False)
 
 
 def spectrogram_to_image(spec, mode='magnitude'):
@@ -95,39 +248,221 @@ def align_wave_head_and_tail(a, b, sr):
     return a, b
 
 
-def cache_or_load(X_path, y_path, v_path, sr, hop_length, n_fft):
-    X_basename = os.path.splitext(os.path.basename(X_path))[0]
-    y_basename = os.path.splitext(os.path.basename(y_path))[0]
-    v_basename = os.path.splitext(os.path.basename(v_path))[0]
+# formats of the training spectrogram caches: full complex64, half precision
+# real and imaginary parts, or half precision magnitude for non-complex training
+CACHE_FORMATS = ['complex64', 'complex32', 'mag16']
+
+
+def encode_cache(spec, cache_format='complex64'):
+    # frame-major (frames, channels, bins) complex spectrogram -> array to np.save
+    if cache_format == 'mag16':
+        return np.abs(spec).astype(np.float16)
+    elif cache_format == 'complex32':
+        # numpy has no half precision complex type, so real and imaginary
+        # parts are stacked on a last axis
+        return np.stack([spec.real, spec.imag], axis=-1).astype(np.float16)
+
+    return np.asarray(spec, dtype=np.complex64)
+
 
+def cache_format_of(array):
+    if array.dtype == np.float16:
+        return 'complex32' if array.ndim == 4 else 'mag16'
+
+    return 'complex64'
+
+
+def decode_cache(array):
+    # cached array (or crop of it) -> frame-major complex64, or float32 magnitude
+    cache_format = cache_format_of(array)
+    if cache_format == 'complex32':
+        return np.ascontiguousarray(array, dtype=np.float32).view(np.complex64)[..., 0]
+    elif cache_format == 'mag16':
+        return array.astype(np.float32)
+
+    return array
+
+
+def cache_meta(array):
+    # shape, format, peak magnitude and checksum of a cached array
+    return {
+        'shape': list(array.shape),
+        'dtype': array.dtype.str,
+        'format': cache_format_of(array),
+        'max': float(np.abs(decode_cache(array)).max()),
+        'sha256': hashlib.sha256(np.ascontiguousarray(array).data).hexdigest(),
+    }
+
+
+def write_cache_meta(path, meta):
+    # sidecar next to the cache, e.g. 01_foo.npy.json
+    meta = dict(meta, size=os.path.getsize(path))
+    with open(path + '.json', 'w', encoding='utf8') as f:
+        json.dump(meta, f)
+
+    return meta
+
+
+def read_cache_meta(path):
+    # the sidecar of a cache, computed and written first if it is missing or stale
+    meta_path = path + '.json'
+    if os.path.exists(meta_path) and os.path.getmtime(meta_path) >= os.path.getmtime(path):
+        with open(meta_path, 'r', encoding='utf8') as f:
+            meta = json.load(f)
+        if meta.get('size') == os.path.getsize(path) and 'sha256' in meta:
+            return meta
+
+    return write_cache_meta(path, cache_meta(np.load(path, mmap_mode='r')))
+
+
+def caches_checksum(paths):
+    # identifies the content and format of a set of caches from their
+    # sidecars, without reading the spectrograms
+    h = hashlib.sha256()
+    for path in paths:
+        meta = read_cache_meta(path)
+        h.update('{} {}\n'.format(meta['format'], meta['sha256']).encode('utf8'))
+
+    return h.hexdigest()
+
+
+def save_cache(path, spec, cache_format='complex64'):
+    # frame-major complex spectrogram -> cache file and its sidecar
+    array = encode_cache(spec, cache_format)
+    tmp_path = path + '.tmp.npy'
+    np.save(tmp_path, array)
+    os.replace(tmp_path, path)
+    write_cache_meta(path, cache_meta(array))
+
+
+def cache_paths(X_path, y_path, v_path, sr, hop_length, n_fft):
     cache_dir = 'sr{}_hl{}_nf{}'.format(sr, hop_length, n_fft)
-    X_cache_dir = os.path.join(os.path.dirname(X_path), cache_dir)
-    y_cache_dir = os.path.join(os.path.dirname(y_path), cache_dir)
-    v_cache_dir = os.path.join(os.path.dirname(v_path), cache_dir)
 
-    X_cache_path = os.path.join(X_cache_dir, X_basename + '.npy')
-    y_cache_path = os.path.join(y_cache_dir, y_basename + '.npy')
-    v_cache_path = os.path.join(v_cache_dir, v_basename + '.npy')
+    return [
+        os.path.join(
+            os.path.dirname(path), cache_dir, os.path.splitext(os.path.basename(path))[0] + '.npy'
+        )
+        for path in [X_path, y_path, v_path]
+    ]
+
+
+def cache_or_load(X_path, y_path, v_path, sr, hop_length, n_fft):
+    X_cache_path, y_cache_path, v_cache_path = cache_paths(X_path, y_path, v_path, sr, hop_length, n_fft)
 
     if os.path.exists(X_cache_path) and os.path.exists(y_cache_path) and os.path.exists(v_cache_path):
-        X = np.load(X_cache_path).transpose(1, 2, 0)
-        y = np.load(y_cache_path).transpose(1, 2, 0)
-        v = np.load(v_cache_path).transpose(1, 2, 0)
+        X = decode_cache(np.load(X_cache_path)).transpose(1, 2, 0)
+        y = decode_cache(np.load(y_cache_path)).transpose(1, 2, 0)
+        v = decode_cache(np.load(v_cache_path)).transpose(1, 2, 0)
 
     assert X.shape == y.shape == v.shape
 
     return X, y, v, X_cache_path, y_cache_path, v_cache_path
 
 
-def spectrogram_to_wave(spec, hop_length=1024):
-    if spec.ndim == 2:
-        wave = librosa.istft(spec, hop_length=hop_length)
-    elif spec.ndim == 3:
-        wave_left = librosa.istft(spec[0], hop_length=hop_length)
-        wave_right = librosa.istft(spec[1], hop_length=hop_length)
-        wave = np.asarray([wave_left, wave_right])
+def spectrogram_to_wave(spec, hop_length=1024, backend=None):
+    backend = backend or _backend
+    n_fft = 2 * (spec.shape[-2] - 1)
+
+    return backend.istft(spec, n_fft, hop_length)
+
+
+def spectrogram_to_mono_wave(spec, hop_length=1024, sr=44100, target_sr=None, backend=None):
+    # the STFT is linear, so averaging the channel spectra equals the STFT of
+    # the averaged channels and a single inverse STFT is enough
+    mono_spec = spec.mean(axis=0, keepdims=True)
+    wave = spectrogram_to_wave(mono_spec, hop_length=hop_length, backend=backend)[0]
+
+    if target_sr is not None and target_sr != sr:
+        wave = librosa.resample(wave, orig_sr=sr, target_sr=target_sr)
+
+    return wave.astype(np.float32)
+
+
+class StreamingSTFT(object):
+
+    def __init__(self, n_fft=2048, hop_length=1024, channels=2):
+        self.n_fft = n_fft
+        self.hop_length = hop_length
+        self.window = hann_window(n_fft)
+        # center=True zero padding of librosa.stft
+        self.buffer = np.zeros((channels, n_fft // 2), dtype=np.float32)
+
+    def _frames(self):
+        n_frames = (self.buffer.shape[1] - self.n_fft) // self.hop_length + 1
+        if n_frames <= 0:
+            return np.zeros((self.buffer.shape[0], self.n_fft // 2 + 1, 0), dtype=np.complex64)
+
+        frames = np.lib.stride_tricks.sliding_window_view(
+            self.buffer, self.n_fft, axis=1
+        )[:, ::self.hop_length][:, :n_frames]
+        spec = np.fft.rfft(frames * self.window, axis=2).astype(np.complex64)
+        self.buffer = self.buffer[:, n_frames * self.hop_length:]
+
+        return spec.transpose(0, 2, 1)
+
+    def push(self, wave):
+        self.buffer = np.concatenate([self.buffer, wave], axis=1)
+        return self._frames()
+
+    def flush(self):
+        pad = np.zeros((self.buffer.shape[0], self.n_fft // 2), dtype=np.float32)
+        self.buffer = np.concatenate([self.buffer, pad], axis=1)
+        return self._frames()
+
+
+class StreamingISTFT(object):
+
+    def __init__(self, n_fft=2048, hop_length=1024, channels=2):
+        self.n_fft = n_fft
+        self.hop_length = hop_length
+        self.window = hann_window(n_fft)
+        self.buffer = np.zeros((channels, n_fft), dtype=np.float32)
+        self.norm = np.zeros(n_fft, dtype=np.float32)
+        # samples of the center padding that are still to be dropped
+        self.trim = n_fft // 2
+        self.n_frames = 0
+
+    def _emit(self, out):
+        if self.trim > 0:
+            n = min(self.trim, out.shape[1])
+            out = out[:, n:]
+            self.trim -= n
+
+        return out
+
+    def push(self, spec):
+        n_frames = spec.shape[2]
+        if n_frames == 0:
+            return np.zeros((self.buffer.shape[0], 0), dtype=np.float32)
+
+        hop = self.hop_length
+        frames = np.fft.irfft(spec.transpose(0, 2, 1), n=self.n_fft, axis=2) * self.window
+
+        buffer = np.concatenate([
+            self.buffer, np.zeros((self.buffer.shape[0], n_frames * hop), dtype=np.float32)
+        ], axis=1)
+        norm = np.concatenate([self.norm, np.zeros(n_frames * hop, dtype=np.float32)])
+        for i in range(n_frames):
+            buffer[:, i * hop:i * hop + self.n_fft] += frames[:, i]
+            norm[i * hop:i * hop + self.n_fft] += self.window ** 2
+
+        # samples before the start of the next frame will not change anymore
+        n_done = n_frames * hop
+        out = buffer[:, :n_done]
+        out_norm = norm[:n_done]
+        nonzero = out_norm > np.finfo(np.float32).tiny
+        out[:, nonzero] /= out_norm[nonzero]
+
+        self.buffer = buffer[:, n_done:]
+        self.norm = norm[n_done:]
+        self.n_frames += n_frames
+
+        return self._emit(out)
 
-    return wave
+    def flush(self):
+        # librosa.istft(center=True) returns hop_length * (n_frames - 1) samples,
+        # so what remains in the buffer is center padding only
+        return np.zeros((self.buffer.shape[0], 0), dtype=np.float32)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,96 @@
+import argparse
+import os
+import time
+
+import numpy as np
+import soundfile as sf
+
+import inference
+from lib import decode
+from lib import realtime
+from lib import replicas
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument('--gpu', '-g', type=int, default=-1)
+    p.add_argument('--pretrained_model', '-P', type=str, default=inference.DEFAULT_MODEL_PATH)
+    p.add_argument('--input', '-i', required=True, help='wave file standing in for the live input')
+    p.add_argument('--sr', '-r', type=int, default=44100)
+    p.add_argument('--n_fft', '-f', type=int, default=None, help='default: from the checkpoint')
+    p.add_argument('--hop_length', '-H', type=int, default=None, help='default: from the checkpoint')
+    p.add_argument('--complex', '-X', action='store_true', default=None)
+    p.add_argument('--block_frames', '-b', type=int, default=8, help='STFT frames per input block')
+    p.add_argument('--lookahead', '-l', type=int, default=16, help='future STFT frames seen by the model')
+    p.add_argument('--peak', type=float, default=None, help='fixed input level instead of the running peak')
+    p.add_argument('--threads', type=int, default=None)
+    p.add_argument('--pace', action='store_true', help='feed blocks at the rate of the input device')
+    p.add_argument('--output_dir', '-o', type=str, default=None, help='write the separated stems')
+    args = p.parse_args()
+
+    if args.threads is not None:
+        replicas.set_threads(args.threads)
+
+    print('loading model...', end=' ')
+    device = inference.get_device(args.gpu)
+    model = inference.load_model(args.pretrained_model, args.n_fft, args.hop_length, args.complex, device)
+    print('done')
+
+    print('loading wave source...', end=' ')
+    X, sr = decode.load_wave(args.input, args.sr)
+    X = inference.to_stereo(X)
+    print('done')
+
+    sp = realtime.RealtimeSeparator(model, device, args.block_frames, args.lookahead, peak=args.peak)
+    block_size = args.block_frames * model.hop_length
+    block_time = block_size / sr
+
+    # one block to warm up, then start over
+    sp.push(np.zeros((2, block_size), dtype=np.float32))
+    sp = realtime.RealtimeSeparator(model, device, args.block_frames, args.lookahead, peak=args.peak)
+
+    print('streaming {:.1f} sec in blocks of {} samples ({:.1f} ms)...'.format(
+        X.shape[1] / sr, block_size, block_time * 1000
+    ))
+    latencies = []
+    underruns = 0
+    y_blocks, v_blocks = [], []
+    start = time.perf_counter()
+    for i in range(0, X.shape[1], block_size):
+        if args.pace:
+            # the block is complete at the device once its last sample is recorded
+            deadline = start + (i + block_size) / sr
+            wait = deadline - time.perf_counter()
+            if wait > 0:
+                time.sleep(wait)
+        arrival = time.perf_counter()
+        y, v = sp.push(X[:, i:i + block_size])
+        latency = time.perf_counter() - arrival
+        latencies.append(latency)
+        if latency > block_time:
+            underruns += 1
+        y_blocks.append(y)
+        v_blocks.append(v)
+    y, v = sp.flush()
+    y_blocks.append(y)
+    v_blocks.append(v)
+    elapsed = time.perf_counter() - start
+
+    latencies = np.array(latencies) * 1000
+    print('blocks: {}, underruns: {}'.format(len(latencies), underruns))
+    print('block latency ms: p50 {:.1f}, p90 {:.1f}, p99 {:.1f}, max {:.1f}'.format(
+        *np.percentile(latencies, [50, 90, 99]), latencies.max()
+    ))
+    print('algorithmic latency: {:.1f} ms'.format((block_size + sp.latency()) / sr * 1000))
+    print('real-time factor: {:.3f}'.format(latencies.sum() / 1000 / (X.shape[1] / sr)))
+    print('wall time: {:.1f} sec'.format(elapsed))
+
+    if args.output_dir is not None:
+        output_dir = inference.prepare_output_dir(args.output_dir)
+        basename = os.path.splitext(os.path.basename(args.input))[0]
+        sf.write('{}{}_Instruments.wav'.format(output_dir, basename), np.concatenate(y_blocks, axis=1).T, sr)
+        sf.write('{}{}_Vocals.wav'.format(output_dir, basename), np.concatenate(v_blocks, axis=1).T, sr)
+
+
+if __name__ == '__main__':
+    main()
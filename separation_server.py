@@ -0,0 +1,140 @@
+import argparse
+import os
+import socketserver
+import threading
+import traceback
+
+from lib import remote
+from lib import spec_utils
+
+import inference
+
+
+class SeparationServer(socketserver.ThreadingTCPServer):
+
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, address, default_model, default_gpu=-1):
+        super(SeparationServer, self).__init__(address, SeparationHandler)
+        self.default_model = default_model
+        self.default_gpu = default_gpu
+        self.separators = {}
+        self.locks = {}
+        self.defaults = {}
+        self.registry_lock = threading.Lock()
+
+    def get_separator(self, job):
+        pretrained_model = job.get('pretrained_model') or self.default_model
+        pretrained_model = os.path.abspath(pretrained_model)
+        gpu = job.get('gpu', self.default_gpu)
+        device = inference.get_device(gpu)
+        key = (
+            pretrained_model, str(device), job.get('n_fft', 2048),
+            job.get('hop_length', 1024), bool(job.get('complex', False))
+        )
+
+        with self.registry_lock:
+            if key not in self.separators:
+                print('loading model {} on {}...'.format(os.path.basename(pretrained_model), device), end=' ')
+                model = inference.load_model(pretrained_model, key[2], key[3], key[4], device)
+                sp = inference.Separator(model=model, device=device)
+                self.separators[key] = sp
+                # autotuned (or default) setting, used by jobs that do not set their own
+                self.defaults[key] = (sp.batchsize, sp.cropsize)
+                self.locks[key] = threading.Lock()
+                print('done')
+
+        return self.separators[key], self.locks[key], self.defaults[key]
+
+    def handle_job(self, job, arrays):
+        command = job.get('command')
+        if command == 'ping':
+            return {'models': len(self.separators)}, None
+
+        sp, lock, (batchsize, cropsize) = self.get_separator(job)
+        if command == 'settings':
+            # the autotuned (or default) setting jobs without their own use
+            return {'batchsize': batchsize, 'cropsize': cropsize}, None
+
+        # one job per model at a time; the separator is shared across connections
+        with lock:
+            sp.batchsize = job.get('batchsize') or batchsize
+            sp.cropsize = job.get('cropsize') or cropsize
+            sp.tta_shifts = job.get('tta_shifts', 2)
+            sp.cheap_tta = job.get('cheap_tta', False)
+            sp.tta_weights = job.get('tta_weights')
+            sp.tta_threshold = job.get('tta_threshold', 0.2)
+            sp.silence_threshold = job.get('silence_threshold')
+
+            if command == 'separate':
+                X_spec = arrays['X_spec']
+                if job.get('tta', False):
+                    y_spec, v_spec = sp.separate_tta(X_spec)
+                else:
+                    y_spec, v_spec = sp.separate(X_spec)
+                return {}, {'y_spec': y_spec, 'v_spec': v_spec}
+            elif command == 'separate_file':
+                inst_path, vocal_path = inference.separate_file(
+                    sp, job['input'], job.get('sr', 44100), job.get('n_fft', 2048), job.get('hop_length', 1024),
+                    tta=job.get('tta', False),
+                    output_dir=job.get('output_dir', ''),
+                    output_image=job.get('output_image', False)
+                )
+                return {'instruments': inst_path, 'vocals': vocal_path}, None
+
+        raise ValueError('unknown command: {}'.format(command))
+
+
+class SeparationHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        while True:
+            job, arrays = remote.recv_message(self.rfile)
+            if job is None:
+                break
+
+            try:
+                reply, reply_arrays = self.server.handle_job(job, arrays)
+                reply['ok'] = True
+            except Exception as e:
+                traceback.print_exc()
+                reply, reply_arrays = {'ok': False, 'error': '{}: {}'.format(type(e).__name__, e)}, None
+
+            remote.send_message(self.wfile, reply, reply_arrays)
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument('--gpu', '-g', type=int, default=-1)
+    p.add_argument('--pretrained_model', '-P', type=str, default=inference.DEFAULT_MODEL_PATH)
+    p.add_argument('--host', type=str, default=remote.DEFAULT_HOST)
+    p.add_argument('--port', '-p', type=int, default=remote.DEFAULT_PORT)
+    p.add_argument('--n_fft', '-f', type=int, default=2048)
+    p.add_argument('--hop_length', '-H', type=int, default=1024)
+    p.add_argument('--complex', '-X', action='store_true')
+    p.add_argument('--stft_backend', type=str, choices=list(spec_utils.BACKENDS), default='librosa')
+    args = p.parse_args()
+
+    spec_utils.set_backend(args.stft_backend, inference.get_device(args.gpu))
+
+    server = SeparationServer((args.host, args.port), args.pretrained_model, args.gpu)
+
+    # warm up the default model so the first job does not pay for it
+    server.get_separator({
+        'n_fft': args.n_fft,
+        'hop_length': args.hop_length,
+        'complex': args.complex
+    })
+
+    print('separation server listening on {}:{}'.format(args.host, args.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,44 @@
+import torch
+
+from lib import dataset
+
+
+def make_training_set(mixup_rate, is_complex=True):
+    return dataset.VocalRemoverTrainingSet(
+        training_set=[], cropsize=8, reduction_rate=0, reduction_weight=0,
+        mixup_rate=mixup_rate, mixup_alpha=1.0, is_complex=is_complex, batch_aug=True
+    )
+
+
+def test_mixup_partners_never_pick_the_sample_itself():
+    torch.manual_seed(0)
+    for batchsize in [2, 3, 4, 8]:
+        idx = torch.arange(batchsize).repeat(1000)
+        partner = dataset.mixup_partners(idx, batchsize)
+        assert (partner != idx).all()
+        assert partner.min() >= 0 and partner.max() < batchsize
+        # every other sample is used
+        for i in range(batchsize):
+            assert set(partner[idx == i].tolist()) == set(range(batchsize)) - {i}
+
+
+def test_augment_batch_mixes_every_selected_sample():
+    torch.manual_seed(0)
+    X = torch.randn(4, 2, 5, 8, dtype=torch.complex64)
+    y, v = X * 0.5, X * 0.5
+    X_orig = X.clone()
+    X_aug, _ = make_training_set(mixup_rate=1.0).augment_batch(X, y, v)
+    # the channel swap may flip a sample, but no sample stays as it was
+    for i in range(4):
+        assert not torch.equal(X_aug[i], X_orig[i])
+        assert not torch.equal(X_aug[i], X_orig[i].flip(0))
+
+
+def test_augment_batch_skips_mixup_for_a_single_sample():
+    torch.manual_seed(0)
+    X = torch.randn(1, 2, 5, 8, dtype=torch.complex64)
+    # X == y, so the rare inst augmentation does not change X either
+    y, v = X.clone(), torch.zeros_like(X)
+    X_orig = X.clone()
+    X_aug, _ = make_training_set(mixup_rate=1.0).augment_batch(X, y, v)
+    assert torch.equal(X_aug[0], X_orig[0]) or torch.equal(X_aug[0], X_orig[0].flip(0))
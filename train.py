@@ -1,17 +1,21 @@
 import argparse
+import copy
 from datetime import datetime
 import json
 import logging
 import os
 import random
+import time
 
 import numpy as np
 import torch
 import torch.nn as nn
 import torch.utils.data
 
+from lib import autotune
 from lib import dataset
 from lib import nets
+from lib import shards
 from lib import spec_utils
 
 
@@ -43,7 +47,58 @@ def to_wave(spec, n_fft, hop_length, window):
     return wave
 
 
-def train_epoch(dataloader, model, device, optimizer, accumulation_steps):
+AMP_DTYPES = {
+    'fp16': torch.float16,
+    'bf16': torch.bfloat16,
+}
+
+
+def synchronize(device):
+    if device.type == 'cuda':
+        torch.cuda.synchronize(device)
+
+
+def make_grad_scaler(device):
+    if hasattr(torch.amp, 'GradScaler'):
+        return torch.amp.GradScaler(device.type)
+    # torch < 2.3 only has the CUDA scaler, fp16 on the CPU then runs unscaled
+    return torch.cuda.amp.GradScaler(enabled=device.type == 'cuda')
+
+
+def peak_memory(device):
+    # only CUDA peaks can be reset; the CPU peak (ru_maxrss) is the peak of the
+    # whole process and says nothing about one epoch or setting
+    if device.type == 'cuda':
+        return autotune.peak_memory(device)
+
+    return None
+
+
+def reset_peak_memory(device):
+    if device.type == 'cuda':
+        torch.cuda.empty_cache()
+        torch.cuda.reset_peak_memory_stats(device)
+
+
+def to_fp32(mask):
+    # complex masks stay complex, a plain .float() would drop the imaginary part
+    if mask.is_complex():
+        return mask.to(torch.complex64)
+
+    return mask.float()
+
+
+def format_step_time(step_time):
+    return 'n/a' if step_time is None else '{:.3f} s'.format(step_time)
+
+
+def format_memory(peak):
+    return 'n/a' if peak is None else '{:.0f} MB'.format(peak / 1024 ** 2)
+
+
+def train_epoch(
+        dataloader, model, device, optimizer, accumulation_steps, teacher=None, distill_weight=0.5,
+        augment=None, amp='off', scaler=None, channels_last=False, max_steps=None):
     is_complex = model.is_complex
     if is_complex:
         n_fft = model.n_fft
@@ -53,13 +108,36 @@ def train_epoch(dataloader, model, device, optimizer, accumulation_steps):
     model.train()
     crit_l1 = nn.L1Loss(reduction='none')
     sum_loss_y = sum_loss_v = 0
+    step_time = 0
+    n_timed = 0
+
+    for itr, batch in enumerate(dataloader):
+        if max_steps is not None and itr >= max_steps:
+            break
+
+        if augment is not None:
+            # (X, y, v) crops, augmented as a batch on the device
+            X_batch, y_batch = augment(*[b.to(device) for b in batch])
+        else:
+            X_batch, y_batch = batch
+            X_batch = X_batch.to(device)
+            y_batch = y_batch.to(device)
 
-    for itr, (X_batch, y_batch) in enumerate(dataloader):
-        X_batch = X_batch.to(device)
-        y_batch = y_batch.to(device)
+        synchronize(device)
+        start = time.perf_counter()
 
-        mask = model(X_batch)
-        y_pred = torch.cat([X_batch, X_batch], dim=1) * mask
+        X_input = X_batch
+        if channels_last and not is_complex:
+            X_input = X_batch.contiguous(memory_format=torch.channels_last)
+
+        with torch.autocast(device.type, dtype=AMP_DTYPES.get(amp), enabled=amp != 'off'):
+            mask = model(X_input)
+            if teacher is not None:
+                with torch.no_grad():
+                    mask_teacher = teacher(X_input)
+
+        # the loss, including the istft of complex mode, is computed in fp32
+        y_pred = torch.cat([X_batch, X_batch], dim=1) * to_fp32(mask)
 
         if is_complex:
             y_wave_batch = to_wave(y_batch, n_fft, hop_length, window)
@@ -70,20 +148,65 @@ def train_epoch(dataloader, model, device, optimizer, accumulation_steps):
         else:
             loss = crit_l1(y_pred, y_batch)
 
-        accum_loss = torch.mean(loss) / accumulation_steps
-        accum_loss.backward()
+        accum_loss = torch.mean(loss)
+        if teacher is not None:
+            # distillation: the student also follows the separation of the teacher
+            y_teacher = torch.cat([X_batch, X_batch], dim=1) * to_fp32(mask_teacher)
+            distill_loss = torch.mean(torch.abs(y_pred - y_teacher))
+            accum_loss = (1 - distill_weight) * accum_loss + distill_weight * distill_loss
+        accum_loss = accum_loss / accumulation_steps
+        if scaler is not None:
+            # fp16 gradients are scaled up to keep them from underflowing
+            scaler.scale(accum_loss).backward()
+        else:
+            accum_loss.backward()
 
         if (itr + 1) % accumulation_steps == 0:
-            optimizer.step()
+            if scaler is not None:
+                scaler.step(optimizer)
+                scaler.update()
+            else:
+                optimizer.step()
             model.zero_grad()
 
+        synchronize(device)
+        if itr > 0:
+            # the first step includes one-off allocations and kernel selection
+            step_time += time.perf_counter() - start
+            n_timed += 1
+
         sum_loss_y += torch.mean(loss[:, :2]).item() * len(X_batch)
         sum_loss_v += torch.mean(loss[:, 2:]).item() * len(X_batch)
 
     avg_loss_y = sum_loss_y / len(dataloader.dataset)
     avg_loss_v = sum_loss_v / len(dataloader.dataset)
 
-    return avg_loss_y, avg_loss_v
+    # None when every step was a first step
+    avg_step_time = step_time / n_timed if n_timed > 0 else None
+
+    return avg_loss_y, avg_loss_v, avg_step_time
+
+
+def benchmark(dataloader, model, device, learning_rate, settings, n_steps, augment=None):
+    # step time and peak memory of a few training steps per (amp, channels_last)
+    # setting, on copies of the model
+    results = []
+    for amp, channels_last in settings:
+        bench_model = copy.deepcopy(model).to(
+            memory_format=torch.channels_last if channels_last else torch.contiguous_format
+        )
+        optimizer = torch.optim.Adam(bench_model.parameters(), lr=learning_rate)
+        scaler = make_grad_scaler(device) if amp == 'fp16' else None
+        reset_peak_memory(device)
+
+        _, _, step_time = train_epoch(
+            dataloader, bench_model, device, optimizer, 1, augment=augment,
+            amp=amp, scaler=scaler, channels_last=channels_last, max_steps=n_steps + 1
+        )
+        results.append((amp, channels_last, step_time, peak_memory(device)))
+        del bench_model, optimizer
+
+    return results
 
 
 def validate_epoch(dataloader, model, device):
@@ -145,13 +268,23 @@ def main():
     p.add_argument('--val_batchsize', '-b', type=int, default=4)
     p.add_argument('--val_cropsize', '-c', type=int, default=256)
     p.add_argument('--num_workers', '-w', type=int, default=4)
+    p.add_argument('--shard_dir', type=str, default=None, help='pack the training spectrograms into a memory-mapped shard here')
     p.add_argument('--epoch', '-E', type=int, default=200)
     p.add_argument('--reduction_rate', '-R', type=float, default=0.0)
     p.add_argument('--reduction_level', '-L', type=float, default=0.2)
     p.add_argument('--mixup_rate', '-M', type=float, default=0.0)
     p.add_argument('--mixup_alpha', '-a', type=float, default=1.0)
+    p.add_argument('--batch_aug', action='store_true', help='augment and mix up whole batches on the training device')
     p.add_argument('--pretrained_model', '-P', type=str, default=None)
     p.add_argument('--complex', '-X', action='store_true')
+    p.add_argument('--nout', type=int, default=32, help='base channels of the network (a multiple of 4)')
+    p.add_argument('--nout_lstm', type=int, default=128, help='LSTM units of the network (a multiple of 2)')
+    p.add_argument('--no_stage2', action='store_true', help='drop the second stage of the cascade')
+    p.add_argument('--teacher_model', '-T', type=str, default=None, help='checkpoint to distill from')
+    p.add_argument('--distill_weight', type=float, default=0.5, help='weight of the teacher loss')
+    p.add_argument('--amp', type=str, choices=['off', 'fp16', 'bf16'], default='off', help='mixed precision training')
+    p.add_argument('--channels_last', action='store_true', help='channels_last memory format for the convolutions')
+    p.add_argument('--benchmark_steps', type=int, default=0, help='only time this many steps against fp32 and exit')
     p.add_argument('--debug', action='store_true')
     args = p.parse_args()
 
@@ -187,12 +320,39 @@ def main():
     reduction_weight = spec_utils.get_reduction_weight(args.n_fft, args.sr, args.reduction_level)
 
     device = torch.device('cpu')
-    model = nets.CascadedNet(args.n_fft, args.hop_length, 32, 128, args.complex)
+    model = nets.CascadedNet(
+        args.n_fft, args.hop_length, args.nout, args.nout_lstm, args.complex, not args.no_stage2
+    )
     if args.pretrained_model is not None:
-        model.load_state_dict(torch.load(args.pretrained_model, map_location=device))
+        pretrained = nets.load_checkpoint(args.pretrained_model, args.n_fft, args.hop_length, args.complex)
+        if pretrained.fused:
+            raise ValueError('{} has BatchNorm folded for inference and cannot be trained'.format(args.pretrained_model))
+        model.load_state_dict(pretrained.state_dict())
+    logger.info('model: {} ({} parameters)'.format(model.arch(), sum(p.numel() for p in model.parameters())))
+
+    teacher = None
+    if args.teacher_model is not None:
+        teacher = nets.load_checkpoint(args.teacher_model, args.n_fft, args.hop_length, args.complex)
+        if (teacher.n_fft, teacher.hop_length, teacher.is_complex) != (args.n_fft, args.hop_length, args.complex):
+            raise ValueError('teacher {} has a different n_fft, hop_length or complex setting'.format(args.teacher_model))
+        teacher.eval()
+        for param in teacher.parameters():
+            param.requires_grad = False
+        logger.info('teacher: {} ({} parameters)'.format(
+            teacher.arch(), sum(p.numel() for p in teacher.parameters())
+        ))
+
     if torch.cuda.is_available() and args.gpu >= 0:
         device = torch.device('cuda:{}'.format(args.gpu))
         model.to(device)
+        if teacher is not None:
+            teacher.to(device)
+    if args.channels_last and args.benchmark_steps == 0:
+        # benchmark() converts its own copies, the fp32 reference stays contiguous
+        model.to(memory_format=torch.channels_last)
+        if teacher is not None:
+            teacher.to(memory_format=torch.channels_last)
+    scaler = make_grad_scaler(device) if args.amp == 'fp16' else None
 
     optimizer = torch.optim.Adam(
         filter(lambda p: p.requires_grad, model.parameters()),
@@ -207,13 +367,29 @@ def main():
         min_lr=args.lr_min,
     )
 
+    # from the cache sidecars only, the shard name needs their checksums too
     trn_set = dataset.make_training_set(
         filelist=trn_filelist,
         sr=args.sr,
         hop_length=args.hop_length,
-        n_fft=args.n_fft
+        n_fft=args.n_fft,
+        is_complex=args.complex
     )
 
+    trn_shards = None
+    if args.shard_dir is not None:
+        shard_path = os.path.join(
+            args.shard_dir, shards.shard_name(trn_set, args.sr, args.hop_length, args.n_fft)
+        )
+        if not shards.exists(shard_path):
+            logger.info('packing training set into {}'.format(shard_path))
+            os.makedirs(args.shard_dir, exist_ok=True)
+            shards.pack(trn_set, shard_path)
+        trn_shards = shards.ShardStore(shard_path)
+        if args.complex and trn_shards.format == 'mag16':
+            raise ValueError('{} is a magnitude-only shard, complex training needs complex64 or complex32'.format(shard_path))
+        trn_set = trn_shards.training_set()
+
     trn_dataset = dataset.VocalRemoverTrainingSet(
         training_set=trn_set * args.patches,
         cropsize=args.cropsize,
@@ -221,7 +397,9 @@ def main():
         reduction_weight=reduction_weight,
         mixup_rate=args.mixup_rate,
         mixup_alpha=args.mixup_alpha,
-        is_complex=args.complex
+        is_complex=args.complex,
+        shards=trn_shards,
+        batch_aug=args.batch_aug
     )
 
     trn_dataloader = torch.utils.data.DataLoader(
@@ -254,15 +432,37 @@ def main():
 
     log = []
     best_loss = np.inf
+    augment = trn_dataset.augment_batch if args.batch_aug else None
+    if args.benchmark_steps > 0:
+        settings = [('off', False)]
+        if (args.amp, args.channels_last) != ('off', False):
+            settings.append((args.amp, args.channels_last))
+        results = benchmark(
+            trn_dataloader, model, device, args.learning_rate, settings, args.benchmark_steps, augment
+        )
+        logger.info('amp   channels_last  step time  peak memory')
+        for amp, channels_last, step_time, peak in results:
+            logger.info('{:<5} {:<14} {:>9}  {:>11}'.format(
+                amp, str(channels_last), format_step_time(step_time), format_memory(peak)
+            ))
+        return
+
     for epoch in range(args.epoch):
         logger.info('# epoch {}'.format(epoch))
-        trn_loss_y, trn_loss_v = train_epoch(trn_dataloader, model, device, optimizer, args.accumulation_steps)
+        reset_peak_memory(device)
+        trn_loss_y, trn_loss_v, step_time = train_epoch(
+            trn_dataloader, model, device, optimizer, args.accumulation_steps, teacher, args.distill_weight,
+            augment, args.amp, scaler, args.channels_last
+        )
         val_loss_y, val_loss_v = validate_epoch(val_dataloader, model, device)
 
         logger.info(
             '  * training loss (y, v) = ({:.6f}, {:.6f}), validation loss (y, v) = ({:.6f}, {:.6f})'
             .format(trn_loss_y, trn_loss_v, val_loss_y, val_loss_v)
         )
+        logger.info('  * step time {}, peak memory {}'.format(
+            format_step_time(step_time), format_memory(peak_memory(device))
+        ))
 
         trn_loss = trn_loss_y + trn_loss_v
         val_loss = val_loss_y + val_loss_v
@@ -272,7 +472,7 @@ def main():
             best_loss = val_loss
             logger.info('  * best validation loss')
             model_path = 'models/model_iter{}.pth'.format(epoch)
-            torch.save(model.state_dict(), model_path)
+            nets.save_checkpoint(model, model_path, args.sr)
 
         log.append([trn_loss, val_loss])
         with open('loss_{}.json'.format(timestamp), 'w', encoding='utf8') as f:
@@ -0,0 +1,38 @@
+import argparse
+import os
+
+from lib import nets
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument('--pretrained_model', '-P', type=str, required=True, help='plain state dict or unfused checkpoint')
+    p.add_argument('--output', '-o', type=str, default=None, help='default: <pretrained_model>_v2.pth')
+    p.add_argument('--sr', '-r', type=int, default=44100)
+    p.add_argument('--n_fft', '-f', type=int, default=2048)
+    p.add_argument('--hop_length', '-H', type=int, default=1024)
+    p.add_argument('--complex', '-X', action='store_true')
+    p.add_argument('--fuse', action='store_true', help='store BatchNorm folded into the convolutions (inference only)')
+    args = p.parse_args()
+
+    output = args.output
+    if output is None:
+        output = os.path.splitext(args.pretrained_model)[0] + '_v2.pth'
+
+    print('loading model...', end=' ')
+    # fails if the weights do not fit the given settings
+    model = nets.load_checkpoint(args.pretrained_model, args.n_fft, args.hop_length, args.complex)
+    if args.fuse:
+        model.fuse_for_inference()
+    print('done')
+
+    print('writing {}...'.format(output), end=' ')
+    nets.save_checkpoint(model, output, model.sr or args.sr)
+    print('done')
+
+    model = nets.load_checkpoint(output, verify=True)
+    print('{} fused={} {}'.format(model.arch(), model.fused, model.checkpoint_hash))
+
+
+if __name__ == '__main__':
+    main()
@@ -5,7 +5,8 @@ class MusicDownloader:
     def __init__(self):
         pass
 
-    def download_music(self, youtube_url):
+    # progress_hook(fraction) 會在下載過程中被呼叫，fraction 介於 0 與 1
+    def download_music(self, youtube_url, progress_hook=None):
         os.makedirs('Downloaded_Music', exist_ok=True)
 
         ydl_opts = {
@@ -18,20 +19,24 @@ class MusicDownloader:
             'outtmpl': 'Downloaded_Music/%(title)s.%(ext)s',
         }
 
-        # 先記住現有檔案集合
-        existing_files = set(os.listdir("Downloaded_Music"))
+        if progress_hook is not None:
+            def hook(d):
+                total = d.get('total_bytes') or d.get('total_bytes_estimate')
+                if d['status'] == 'downloading' and total:
+                    progress_hook(d.get('downloaded_bytes', 0) / total)
+                elif d['status'] == 'finished':
+                    progress_hook(1.0)
+            ydl_opts['progress_hooks'] = [hook]
 
+        # 直接由下載資訊算出檔名，多個下載同時進行時也不會拿錯檔案
         with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            ydl.download([youtube_url])
+            info = ydl.extract_info(youtube_url, download=True)
+            mp3_path = os.path.splitext(ydl.prepare_filename(info))[0] + ".mp3"
 
-        # 下載完後找出新增的檔案
-        new_files = set(os.listdir("Downloaded_Music")) - existing_files
-        mp3_files = [f for f in new_files if f.endswith(".mp3")]
-
-        if not mp3_files:
+        if not os.path.exists(mp3_path):
             raise FileNotFoundError("❌ 沒有找到剛下載的 mp3 檔案")
 
-        return os.path.join("Downloaded_Music", mp3_files[0])
+        return mp3_path
 
     def close_driver(self):
         pass
\ No newline at end of file